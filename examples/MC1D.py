@@ -2,19 +2,17 @@
 
 import mcsled
 import random
-import copy
 import time
-
-
-class Particle1D:
-    """ A 1D particle defined only by its position, x. """
-
-    def __init__(self,x):
-        self.x = x
+import numpy as np
+from numba import njit
 
 
 class System:
     """ A system of N 1D particles.
+    Particle positions are held in a single float64 array, self.pos,
+    which is kept sorted so that the neighbours of a particle within the
+    square-well cutoff can be found by binary search. self.labels[k] is
+    the original label of the particle currently in sorted slot k.
     Has the required get_size, get_moves, and get_energy methods
     for mcsled.
     """
@@ -24,50 +22,46 @@ class System:
         self.minx = minx
         self.maxx = maxx
         self.saved_state = None
+        self.saved_labels = None
         self.use_dE = True
         if ranseed:
             random.seed(ranseed)
 
         # Randomly assign starting positions for N particles.
-        startpositions = [random.random() * (maxx - minx) + minx
-                          for i in range(self.N)]
-        self.particles = [Particle1D(x) for x in startpositions]
-        self.size = len(self.particles)
+        self.pos = np.empty(N, dtype=np.float64)
+        for i in range(self.N):
+            self.pos[i] = random.random() * (maxx - minx) + minx
+        self.labels = np.argsort(self.pos)
+        self.pos = self.pos[self.labels]
+        self.size = len(self.pos)
 
         # define moves
-        self.jump = Move(1,0.3,self.get_particles())
-        self.bigjump = Move(0.1,2.0,self.get_particles())
+        self.jump = Move(1,0.3,self.get_positions(),self.labels)
+        self.bigjump = Move(0.1,2.0,self.get_positions(),self.labels)
         self.moves = [self.jump,self.bigjump]
 
         # define energy components
         self.extE = ExternalEnergy(-4.0,4.0,100.0)
 #        self.extE = ExternalEnergy(0.0,1.0,1.0)
         self.ppE = PPEnergy(0.05,0.3,1.0)
+        self.total_energy, self.energy_change = (
+            make_energy_kernels(self.ppE,self.extE))
 
-    def get_particles(self):
-        """ Return the list of particle objects. """
-        return self.particles
+    def get_positions(self):
+        """ Return the (sorted) array of particle positions. """
+        return self.pos
 
     def get_energy(self):
         """ Calculate and return the total energy of the system. """
-        extE = sum([self.extE.E(p) for p in self.particles])
-        mysum = 0.0
-        for i,p in enumerate(self.particles[:-1]):
-            otherps = self.particles[i + 1:]
-            mye = sum([self.ppE.E(p,p2) for p2 in otherps])
-            mysum += mye
-        return mysum + extE
+        return self.total_energy(self.pos)
 
     def get_energy_change(self,move):
-        """ Calculate and return energy change due to move. """
-        p_moved = move.get_moved_p()
-        p_unmoved = move.get_unmoved_p()
-        pidx = self.particles.index(p_unmoved)
-        dextE = self.extE.E(p_moved) - self.extE.E(p_unmoved)
-        cutlist = self.particles[:pidx] + self.particles[pidx + 1:]
-        mydE = (sum([self.ppE.E(p_moved,p2) for p2 in cutlist])
-                - sum([self.ppE.E(p_unmoved,p2) for p2 in cutlist]))
-        return dextE + mydE
+        """ Calculate and return energy change due to move.
+        The move changes only the particle in slot move.indices[0], so
+        only the pair terms of its old and new neighbours are summed.
+        """
+        return self.energy_change(self.pos,move.indices[0],
+                                  move.get_moved_x())
 
     def get_moves(self):
         """ Return a list of the move objects. """
@@ -79,7 +73,8 @@ class System:
 
     def save_state(self):
         """ Make a copy of the current state of the system. """
-        self.saved_state  = copy.deepcopy(self.particles)
+        self.saved_state = self.pos.copy()
+        self.saved_labels = self.labels.copy()
 
     def get_saved_state(self):
         """ Return the saved state. """
@@ -87,66 +82,170 @@ class System:
 
     def set_saved_state(self):
         """ Set the saved state to the current state. """
-        self.particles = copy.deepcopy(self.saved_state)
+        self.pos[:] = self.saved_state
+        self.labels[:] = self.saved_labels
 
 
-class Move:
+class Move(mcsled.IncrementalMove):
     """ A move is a displacement of one particle by a random amount up to
     maxmove. 'probability' should be proportional to the fraction of moves
     chosen with this type.
-    Has the required trial_move, make_move, unmake_move, and get_probability
-    methods for mcsled.
+    An mcsled.IncrementalMove: its trial_move stores the sorted slot of the
+    particle to move in self.indices, for System.get_energy_change.
+    Adds the make_move and unmake_move methods required by mcsled.
+    Sets accepts_uniforms, so MCSim hands trial_move its two uniform random
+    numbers from the batches it draws.
     """
 
-    def __init__(self,probability,maxmove,particles):
-        self.probability = probability  # prop. to num times this move called
+    accepts_uniforms = True
+
+    def __init__(self,probability,maxmove,positions,labels):
+        # probability is prop. to num times this move called
+        super().__init__(probability)
         self.maxmove = maxmove
-        self.particles = particles
-        self.p = None
-        self.tmpp = Particle1D(0.0)
+        self.pos = positions
+        self.labels = labels
+        self.pidx = None
+        self.newidx = None
+        self.xold = None
+        self.xnew = None
         self.dx = None
 
-    def get_moved_p(self):
-        return self.tmpp
-
-    def get_unmoved_p(self):
-        return self.p
+    def get_moved_x(self):
+        return self.xnew
 
-    def trial_move(self):
-        """ Chooses which particle to move and how far """
-        self.p = random.choice(self.particles)
-        self.dx = random.random() * (2 * self.maxmove) - self.maxmove
-        self.tmpp.x = self.p.x + self.dx
+    def affected_indices(self,u1,u2):
+        """ Chooses which particle to move, with u1, and how far, with u2.
+        Returns the sorted slot of that particle, the only one changed.
+        """
+        self.pidx = int(u1 * len(self.pos))
+        self.dx = u2 * (2 * self.maxmove) - self.maxmove
+        self.xold = self.pos[self.pidx]
+        self.xnew = self.xold + self.dx
+        return (self.pidx,)
 
     def make_move(self):
-        """ Actually displace the input particle. """
-        self.p.x += self.dx
+        """ Actually displace the chosen particle, keeping pos sorted. """
+        self.newidx = relocate(self.pos,self.labels,self.pidx,self.xnew)
 
     def unmake_move(self):
         """ Move it back in case of move rejection. """
-        self.p.x -= self.dx
+        relocate(self.pos,self.labels,self.newidx,self.xold)
+
+
+@njit(cache=True)
+def relocate(pos,labels,i,x):
+    """ Move the particle in sorted slot i of pos to position x,
+    shifting the particles in between by one slot so that pos stays sorted.
+    labels is shifted along with pos. Returns the new slot of the particle.
+    """
+    label = labels[i]
+    k = i
+    while k > 0 and pos[k - 1] > x:
+        pos[k] = pos[k - 1]
+        labels[k] = labels[k - 1]
+        k -= 1
+    while k < len(pos) - 1 and pos[k + 1] < x:
+        pos[k] = pos[k + 1]
+        labels[k] = labels[k + 1]
+        k += 1
+    pos[k] = x
+    labels[k] = label
+    return k
+
+
+def make_energy_kernels(ppE,extE):
+    """ Compile and return the (total_energy, energy_change) kernels
+    for the pair and external energies ppE and extE.
+    The potential parameters are read into locals here and captured by the
+    closures, so numba compiles them in as constants rather than passing
+    them (or looking them up as attributes) on every call.
+    """
+    sig1 = ppE.sig1
+    sig2 = ppE.sig2
+    depth = ppE.depth
+    core = ppE.core
+    xleft = extE.xleft
+    xright = extE.xright
+    strength = extE.strength
+
+    @njit(fastmath=True)
+    def ext_E(x):
+        """ Particle-external field energy for a particle at x. """
+        if x < xleft or x > xright:
+            return 1.0e6
+        dl = x - xleft
+        dr = x - xright
+        dl2 = dl * dl
+        dr2 = dr * dr
+        return strength * (1.0 / (dl2 * dl2 * dl2) + 1.0 / (dr2 * dr2 * dr2))
+
+    @njit(fastmath=True)
+    def pp_E(dx):
+        """ Square-well energy for a pair of particles dx apart. """
+        if dx <= sig1:
+            return core
+        elif dx <= sig2:
+            return -depth
+        else:
+            return 0.0
+
+    @njit(fastmath=True)
+    def total_energy(pos):
+        """ Total energy of the particles at the sorted positions pos.
+        The inner loop stops at the first particle beyond the sig2 cutoff.
+        Serial: it is called about once per anneal, and a parallel loop
+        would start a thread pool that breaks forked Replicates workers.
+        """
+        energy = 0.0
+        n = len(pos)
+        for i in range(n):
+            e = ext_E(pos[i])
+            for j in range(i + 1,n):
+                dx = pos[j] - pos[i]
+                if dx > sig2:
+                    break
+                e += pp_E(dx)
+            energy += e
+        return energy
 
-    def get_probability(self):
-        """ Return the (unnormalized) probability for this move. """
-        return self.probability
+    @njit(fastmath=True)
+    def pair_energy(pos,x,skip):
+        """ Pair energy of a particle at x with the particles at the sorted
+        positions pos, leaving out the one in slot skip.
+        """
+        energy = 0.0
+        for j in range(np.searchsorted(pos,x - sig2),len(pos)):
+            dx = pos[j] - x
+            if dx > sig2:
+                break
+            if j != skip:
+                energy += pp_E(abs(dx))
+        return energy
+
+    @njit(fastmath=True)
+    def energy_change(pos,i,x):
+        """ Energy change for moving the particle in sorted slot i of pos
+        to x. Only the neighbours within sig2 of the old and new positions
+        are visited, so the cost depends on the local density, not on N.
+        """
+        xold = pos[i]
+        dextE = ext_E(x) - ext_E(xold)
+        dppE = pair_energy(pos,x,i) - pair_energy(pos,xold,i)
+        return dextE + dppE
+
+    return total_energy, energy_change
 
 
 class ExternalEnergy:
-    """ Convex external field. """
+    """ Convex external field, with 1/d**6 walls at xleft and xright.
+    The energy itself is evaluated by the kernels from make_energy_kernels.
+    """
 
     def __init__(self,xleft,xright,strength):
         self.xleft = xleft
         self.xright = xright
         self.strength = strength
-        self.n = 6
-
-    def E(self,p):
-        """ Return the particle-external field interaction energy. """
-        if p.x < self.xleft or p.x > self.xright:
-            return 1.0e6
-        energy = self.strength * (1.0 / (p.x - self.xleft)**self.n
-                                  + 1.0 / (p.x - self.xright)**self.n)
-        return energy
 
 # class ExternalEnergy:
 #     """ Convex external field. """
@@ -163,7 +262,9 @@ class ExternalEnergy:
 
 
 class PPEnergy:
-    """ Square-well interaction between two particles. """
+    """ Square-well interaction between two particles.
+    The energy itself is evaluated by the kernels from make_energy_kernels.
+    """
 
     def __init__(self,sigma1,sigma2,depth):
         self.sig1 = sigma1
@@ -171,18 +272,6 @@ class PPEnergy:
         self.depth = depth
         self.core = 1.0e6
 
-    def E(self,p1,p2):
-        """ Return the particle-particle energy
-        for the input pair of particles.
-        """
-        dx = abs(p2.x - p1.x)
-        if dx <= self.sig1:
-            return(self.core)
-        elif dx <= self.sig2:
-            return(-self.depth)
-        else:
-            return(0.0)
-
 
 if __name__ == "__main__":
 
@@ -201,8 +290,8 @@ if __name__ == "__main__":
         # A '*' is output at the position for each particle.
         # An 'x' is output at a position holding more than one particle.
         vis = [" "] * nout
-        for p in sys.get_particles():
-            relpos = int((p.x - posl) / (posr - posl) * nout)
+        for x in sys.get_positions():
+            relpos = int((x - posl) / (posr - posl) * nout)
             if relpos > nout - 1:
                 relpos = nout - 1
             if relpos < 0:
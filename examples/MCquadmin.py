@@ -4,7 +4,6 @@ import mcsled
 import random
 import math
 import time
-import copy
 
 
 class System:
@@ -22,6 +21,8 @@ class System:
         self.maxx = maxxy
         self.saved_state = None
         self.use_dE = False
+        # get_energy is one function evaluation; size is only a cycle length
+        self.cheap_energy = True
         self.size = 1000
         if ranseed:
             random.seed(ranseed)
@@ -56,7 +57,7 @@ class System:
 
     def save_state(self):
         """ Make a copy of the current state of the system. """
-        self.saved_state  = copy.deepcopy(self.position)
+        self.saved_state = self.position[:]
 
     def get_saved_state(self):
         """ Return the saved state. """
@@ -64,7 +65,7 @@ class System:
 
     def set_saved_state(self):
         """ Set the saved state to the current state. """
-        self.position = copy.deepcopy(self.saved_state)
+        self.position[:] = self.saved_state
 
 
 class Move:
@@ -73,40 +74,53 @@ class Move:
     chosen with this type.
     Has the required trial_move, make_move, unmake_move, and get_probability
     methods for MCHammer.
+    Sets accepts_uniforms, so MCSim hands trial_move its two uniform random
+    numbers from the batches it draws, instead of calling random here.
+    The step size is maxmove * scale; MCSim adjusts scale toward the
+    schedule's target_accept rate.
     """
 
+    accepts_uniforms = True
+
     def __init__(self,probability,maxmove,minxy,maxxy,system_position):
         self.probability = probability  # prop. to num times this move called
         self.maxmove = maxmove
         self.minxy = minxy
         self.maxxy = maxxy
         self.pos = system_position
+        self.oldx = None
+        self.oldy = None
+        self.scale = 1.0
         self.dx = None
         self.dy = None
 
-    def trial_move(self):
-        self.dx = random.random() * (2 * self.maxmove) - self.maxmove
-        self.dy = random.random() * (2 * self.maxmove) - self.maxmove
+    def trial_move(self,u1,u2):
+        step = self.maxmove * self.scale
+        self.dx = u1 * (2 * step) - step
+        self.dy = u2 * (2 * step) - step
         # print("trial dx,dy: ",self.dx,self.dy)
 
     def make_move(self):
-        """ Actually displace the point. """
-        self.pos[0] += self.dx
-        if self.pos[0] > self.maxxy:
-            self.pos[0] = self.maxxy
-        if self.pos[0] < self.minxy:
-            self.pos[0] = self.minxy
-        self.pos[1] += self.dy
-        if self.pos[1] > self.maxxy:
-            self.pos[1] = self.maxxy
-        if self.pos[1] < self.minxy:
-            self.pos[1] = self.minxy
+        """ Actually displace the point, clamped to [minxy,maxxy]. """
+        # Conditional expressions on Python floats: in CPython they cost a
+        # fraction of the builtin min/max calls they replace.
+        pos = self.pos
+        lo = self.minxy
+        hi = self.maxxy
+        self.oldx = oldx = pos[0]
+        self.oldy = oldy = pos[1]
+        x = oldx + self.dx
+        y = oldy + self.dy
+        pos[0] = lo if x < lo else hi if x > hi else x
+        pos[1] = lo if y < lo else hi if y > hi else y
         # print("displaced point: ",self.pos[0],self.pos[1])
 
     def unmake_move(self):
-        """ Move it back in case of move rejection. """
-        self.pos[0] -= self.dx
-        self.pos[1] -= self.dy
+        """ Move it back in case of move rejection.
+        Restores the pre-move point, which also undoes any clamping.
+        """
+        self.pos[0] = self.oldx
+        self.pos[1] = self.oldy
 
     def get_probability(self):
         """ Return the (unnormalized) probability for this move. """
@@ -131,7 +145,8 @@ if __name__ == "__main__":
 
     # Set up the Annealing schedule and the Simulation
     schedule = mcsled.AnnealingSchedule(Ti=10,Tf=0.001,reduce=0.96,
-                                        ncycles=200,nstop=25)
+                                        ncycles=200,nstop=25,
+                                        target_accept=0.4)
     sim = mcsled.MCSim(sys,schedule)
 
     # Run it.
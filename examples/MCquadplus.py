@@ -4,7 +4,6 @@ import mcsled
 import random
 import math
 import time
-import copy
 
 
 class System:
@@ -15,6 +14,8 @@ class System:
     """
 
     def __init__(self,minxy,maxxy,initx,inity,ranseed=None):
+        # A Python list of floats: the moves read and write it once per
+        # step, which is much cheaper than ndarray element access.
         self.position = [initx,inity]
         self.oldx = None
         self.oldy = None
@@ -22,6 +23,8 @@ class System:
         self.maxx = maxxy
         self.saved_state = None
         self.use_dE = False
+        # get_energy is one function evaluation; size is only a cycle length
+        self.cheap_energy = True
         self.size = 1000
         if ranseed:
             random.seed(ranseed)
@@ -41,16 +44,8 @@ class System:
         """ Return a list of the move objects. """
         return self.moves
 
-    def function(self,x,y):
-        """  quadratic plus local well """
-        f = x**2 + y**2
-        if x < -2.3 and x > -2.7:
-            if y < 2.7 and y > 2.3:
-                f -= 8.0
-        return f
-
     def get_energy(self):
-        f = self.function(self.position[0],self.position[1])
+        f = fquad(self.position[0],self.position[1])
         # print("In get_energy x,y,f: ",self.position[0],self.position[1],f)
         return f
 
@@ -59,7 +54,7 @@ class System:
 
     def save_state(self):
         """ Make a copy of the current state of the system. """
-        self.saved_state  = copy.deepcopy(self.position)
+        self.saved_state = self.position[:]
 
     def get_saved_state(self):
         """ Return the saved state. """
@@ -67,7 +62,15 @@ class System:
 
     def set_saved_state(self):
         """ Set the saved state to the current state. """
-        self.position = copy.deepcopy(self.saved_state)
+        self.position[:] = self.saved_state
+
+
+def fquad(x,y):
+    """  quadratic plus local well, at the point x,y """
+    f = x * x + y * y
+    if -2.7 < x < -2.3 and 2.3 < y < 2.7:
+        f -= 8.0
+    return f
 
 
 class Move:
@@ -76,40 +79,50 @@ class Move:
     chosen with this type.
     Has the required trial_move, make_move, unmake_move, and get_probability
     methods for MCHammer.
+    Sets accepts_uniforms, so MCSim hands trial_move its two uniform random
+    numbers from the batches it draws.
     """
 
+    accepts_uniforms = True
+
     def __init__(self,probability,maxmove,minxy,maxxy,system_position):
         self.probability = probability  # prop. to num times this move called
         self.maxmove = maxmove
         self.minxy = minxy
         self.maxxy = maxxy
         self.pos = system_position
+        self.oldx = None
+        self.oldy = None
         self.dx = None
         self.dy = None
 
-    def trial_move(self):
-        self.dx = random.random() * (2 * self.maxmove) - self.maxmove
-        self.dy = random.random() * (2 * self.maxmove) - self.maxmove
+    def trial_move(self,u1,u2):
+        self.dx = u1 * (2 * self.maxmove) - self.maxmove
+        self.dy = u2 * (2 * self.maxmove) - self.maxmove
         # print("trial dx,dy: ",self.dx,self.dy)
 
     def make_move(self):
-        """ Actually displace the point. """
-        self.pos[0] += self.dx
-        if self.pos[0] > self.maxxy:
-            self.pos[0] = self.maxxy
-        if self.pos[0] < self.minxy:
-            self.pos[0] = self.minxy
-        self.pos[1] += self.dy
-        if self.pos[1] > self.maxxy:
-            self.pos[1] = self.maxxy
-        if self.pos[1] < self.minxy:
-            self.pos[1] = self.minxy
+        """ Actually displace the point, clamped to [minxy,maxxy]. """
+        # Conditional expressions on Python floats: in CPython they cost a
+        # fraction of the builtin min/max calls they replace.
+        pos = self.pos
+        lo = self.minxy
+        hi = self.maxxy
+        self.oldx = oldx = pos[0]
+        self.oldy = oldy = pos[1]
+        x = oldx + self.dx
+        y = oldy + self.dy
+        pos[0] = lo if x < lo else hi if x > hi else x
+        pos[1] = lo if y < lo else hi if y > hi else y
         # print("displaced point: ",self.pos[0],self.pos[1])
 
     def unmake_move(self):
-        """ Move it back in case of move rejection. """
-        self.pos[0] -= self.dx
-        self.pos[1] -= self.dy
+        """ Move it back in case of move rejection.
+        Restores the pre-move point, which also undoes any clamping.
+        """
+        pos = self.pos
+        pos[0] = self.oldx
+        pos[1] = self.oldy
 
     def get_probability(self):
         """ Return the (unnormalized) probability for this move. """
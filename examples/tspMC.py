@@ -2,53 +2,58 @@
 
 import mcsled
 import random
-import copy
 import time
-import math
-import matplotlib.pyplot as plt
-import functools
-
-
-class City:
-    """ A city defined only by its position, x,y. """
-
-    def __init__(self,x):  # x should be a list with two elements: x&y postions
-        self.x = x
+import numpy as np
+from numba import njit
 
 
 class System:
     """ A system of N Cities and a cyclic path between them.
+    coords is an N x 2 array of the city x,y positions; a city is
+    identified by its row in coords. The path is held as a permutation
+    array, self.perm, of city indexes.
     Has the required get_size, get_moves, and get_energy methods
     for mcsled.
     """
 
-    def __init__(self,N,cities,use_dE):
-        # minx and max x are 2-element lists
-        self.cities = cities
-        self.N = len(cities)
+    def __init__(self,N,coords,use_dE):
+        self.coords = np.ascontiguousarray(coords,dtype=np.float64)
+        self.N = len(self.coords)
+        self.perm = np.arange(self.N)
         self.saved_state = None
         self.moves = None
         self.use_dE = use_dE
 
         # define moves
-        self.swap = SwapMove(1,self.get_cities())
-        self.moves = [self.swap]
+        self.swap = SwapMove(0.1,self.perm)
+        self.twoopt = TwoOptMove(1,self.perm)
+        self.moves = [self.swap,self.twoopt]
 
         # define energy components
-        self.energy = Energy()
+        self.energy = Energy(self.coords)
+        self.E = self.energy.E(self.perm)
 
-    def get_cities(self):
-        """ Return the list of city objects. """
-        return self.cities
+    def get_path(self):
+        """ Return the N x 2 array of city positions in path order. """
+        return self.coords[self.perm]
 
     def get_energy(self):
-        """ Calculate and return the total energy of the system. """
-        energy = self.energy.E(self.cities)
+        """ Return the total energy of the system.
+        With use_dE, this is the running total kept by commit;
+        otherwise it is recalculated from the current path.
+        """
+        if self.use_dE:
+            return self.E
+        energy = self.energy.E(self.perm)
         return energy
 
+    def commit(self,dE):
+        """ Add the energy change of an accepted move to the running total. """
+        self.E += dE
+
     def get_energy_change(self,move):
         """ Calculate and return energy change due to move. """
-        dE = self.energy.dE(self.cities,move)
+        dE = self.energy.dE(self.perm,move)
         return dE
 
     def get_moves(self):
@@ -60,8 +65,13 @@ class System:
         return self.N
 
     def save_state(self):
-        """ Make a copy of the current state of the system. """
-        self.saved_state  = copy.deepcopy(self.cities)
+        """ Make a copy of the current state of the system.
+        Also recomputes the running total energy from the path: the dE
+        kept by commit come from the float32 distances, so the total
+        drifts from the true path length over many moves.
+        """
+        self.saved_state = self.perm.copy()
+        self.E = self.energy.E(self.perm)
 
     def get_saved_state(self):
         """ Return the saved state. """
@@ -69,18 +79,41 @@ class System:
 
     def set_saved_state(self):
         """ Set the saved state to the current state. """
-        self.cities = copy.deepcopy(self.saved_state)
+        self.perm[:] = self.saved_state
+        self.E = self.energy.E(self.perm)
 
 
 class Move:
     """ A move is a modification of the cities path.
     Has the required trial_move, make_move, unmake_move, and get_probability
     methods for mcsled.
+    Sets accepts_uniforms, so MCSim hands trial_move its two uniform random
+    numbers from the batches it draws, which pick the path positions.
     """
 
-    def __init__(self,probability,cities):
+    accepts_uniforms = True
+    lo = 0  # lowest path position a move may pick
+
+    def __init__(self,probability,perm):
         self.probability = probability  # prop. to num times this move called
-        self.cities = cities
+        self.perm = perm
+        self.i = None
+        self.j = None
+
+    def pick_pair(self,u1,u2):
+        """ Return two different path positions, both >= lo, picked by
+        the uniform random numbers u1 and u2.
+        """
+        n = len(self.perm) - self.lo
+        i = int(u1 * n)
+        # j is picked from the n-1 positions other than i
+        j = int(u2 * (n - 1))
+        if j >= i:
+            j += 1
+        return i + self.lo, j + self.lo
+
+    def get_moved_positions(self):
+        return self.i, self.j
 
     def get_probability(self):
         """ Return the (unnormalized) probability for this move. """
@@ -95,85 +128,127 @@ class SwapMove(Move):
     methods for mcsled.
     """
 
-    def __init__(self,probability,cities):
-        super().__init__(probability,cities)
-        self.c1 = None
-        self.c2 = None
-
-    def get_moved_cities(self):
-        return self.c1, self.c2
-
-    def trial_move(self):
-        """ Chooses two different cities """
-        self.c1 = random.choice(self.cities)
-        self.c2 = random.choice(self.cities)
-        while self.c2 == self.c1:
-            self.c2 = random.choice(self.cities)
+    def trial_move(self,u1,u2):
+        """ Chooses two different positions in the path """
+        self.i, self.j = self.pick_pair(u1,u2)
 
     def make_move(self):
         """ Actually swap the cities in the path """
-        self.idx1 = self.cities.index(self.c1)
-        self.idx2 = self.cities.index(self.c2)
-        self.cities[self.idx1] = self.c2
-        self.cities[self.idx2] = self.c1
+        perm = self.perm
+        perm[self.i], perm[self.j] = perm[self.j], perm[self.i]
 
     def unmake_move(self):
         """ Move them back in case of move rejection. """
-        self.cities[self.idx1] = self.c1
-        self.cities[self.idx2] = self.c2
+        self.make_move()
+
+
+class TwoOptMove(Move):
+    """ A 2-opt move reverses the section of the path between positions
+    i < j. Only the two edges at the ends of the section change, so it
+    mixes better than a swap and its energy change needs just four
+    distances.
+    'probability' should be proportional to the fraction of moves
+    chosen with this type.
+    Has the required trial_move, make_move, unmake_move, and get_probability
+    methods for mcsled.
+    """
+
+    lo = 1  # keep position 0 fixed so the reversed section never wraps
+
+    def trial_move(self,u1,u2):
+        """ Chooses the two ends of the section to reverse """
+        i,j = self.pick_pair(u1,u2)
+        if i > j:
+            i,j = j,i
+        self.i = i
+        self.j = j
+
+    def make_move(self):
+        """ Actually reverse the section of the path """
+        self.perm[self.i:self.j + 1] = self.perm[self.i:self.j + 1][::-1]
+
+    def unmake_move(self):
+        """ Reverse it back in case of move rejection. """
+        self.make_move()
+
+
+@njit(cache=True)
+def twoopt_dE(D,perm,i,j):
+    """ Path length change for reversing perm[i:j+1], 1 <= i < j.
+    Distances are summed in float64 even though D may be float32
+    (float() of a float32 stays float32 in numba, so np.float64 is used).
+    """
+    a = perm[i - 1]
+    b = perm[i]
+    c = perm[j]
+    d = perm[(j + 1) % len(perm)]
+    newE = np.float64(D[a,c]) + np.float64(D[b,d])
+    oldE = np.float64(D[a,b]) + np.float64(D[c,d])
+    return newE - oldE
+
+
+@njit(cache=True)
+def swap_dE(D,perm,i,j):
+    """ Path length change for swapping the cities at perm[i] and perm[j].
+    Distances are summed in float64 even though D may be float32.
+    """
+    N = len(perm)
+    c1 = perm[i]
+    c2 = perm[j]
+    c1left = perm[(i - 1) % N]
+    c1right = perm[(i + 1) % N]
+    c2left = perm[(j - 1) % N]
+    c2right = perm[(j + 1) % N]
+    if c1 == c2left:  # c2 = c1right also
+        oldpartialE = np.float64(D[c1left,c1]) + np.float64(D[c2right,c2])
+        newpartialE = np.float64(D[c1left,c2]) + np.float64(D[c2right,c1])
+    elif c1 == c2right:  # c2 = c1left also
+        oldpartialE = np.float64(D[c1right,c1]) + np.float64(D[c2left,c2])
+        newpartialE = np.float64(D[c1right,c2]) + np.float64(D[c2left,c1])
+    else:
+        oldpartialE = (np.float64(D[c1left,c1]) + np.float64(D[c1right,c1])
+                       + np.float64(D[c2left,c2]) + np.float64(D[c2right,c2]))
+        newpartialE = (np.float64(D[c1left,c2]) + np.float64(D[c1right,c2])
+                       + np.float64(D[c2left,c1]) + np.float64(D[c2right,c1]))
+    return newpartialE - oldpartialE
 
 
 class Energy:
-    """ The path length for the traversing the cities. """
-
-    def E(self,cities):
-        distances = [self.mydist(cities[i],cities[i + 1])
-                     for i in range(len(cities) - 1)]
-        totald = sum(distances) + self.mydist(cities[0],cities[-1])
-        return totald
-
-    @functools.lru_cache(maxsize=16384)
-    def mydist(self,c1,c2):
-        return(math.dist(c1.x,c2.x))
-
-    def dE(self,cities,move):
-        c1,c2 = move.get_moved_cities()
-        c1left,c1right = self.get_neighbors(c1,cities)
-        c2left,c2right = self.get_neighbors(c2,cities)
-        if c1 is c2left:  # c2 = c1right also
-            oldpartialE = self.mydist(c1left,c1) + self.mydist(c2right,c2)
-            newpartialE = self.mydist(c1left,c2) + self.mydist(c2right,c1)
-        elif c1 is c2right:  # c2 = c1left also
-            oldpartialE = self.mydist(c1right,c1) + self.mydist(c2left,c2)
-            newpartialE = self.mydist(c1right,c2) + self.mydist(c2left,c1)
-        else:
-            oldpartialE = (self.mydist(c1left,c1) + self.mydist(c1right,c1)
-                           + self.mydist(c2left,c2) + self.mydist(c2right,c2))
-            newpartialE = (self.mydist(c1left,c2) + self.mydist(c1right,c2)
-                           + self.mydist(c2left,c1) + self.mydist(c2right,c1))
-        deltaE = newpartialE - oldpartialE
-        return deltaE
-
-    def get_neighbors(self,city,cities):
-        N = len(cities)
-        idx = cities.index(city)
-        left = idx - 1
-        right = idx + 1
-        if idx == 0:
-            left = N - 1
-        elif idx == N - 1:
-            right = 0
-        return cities[left], cities[right]
+    """ The path length for the traversing the cities.
+    All city-city distances are computed once, up front, into self.D.
+    D is stored as float32: it is only read for move energy changes, where
+    single precision is ample, and it halves the cache footprint for
+    large N.
+    """
+
+    def __init__(self,coords):
+        self.coords = coords
+        pts = self.coords
+        self.D = np.sqrt(((pts[:,None,:] - pts[None,:,:])**2).sum(-1))
+        self.D = self.D.astype(np.float32)
+
+    def E(self,perm):
+        path = self.coords[perm]
+        x = path[:,0]
+        y = path[:,1]
+        totald = np.hypot(np.diff(x,append=x[0]),np.diff(y,append=y[0])).sum()
+        return float(totald)
+
+    def dE(self,perm,move):
+        i,j = move.get_moved_positions()
+        if isinstance(move,TwoOptMove):
+            return twoopt_dE(self.D,perm,i,j)
+        return swap_dE(self.D,perm,i,j)
 
 
 if __name__ == "__main__":
 
-    def dump(cities,fignum,figname,txt):
+    import matplotlib.pyplot as plt
+
+    def dump(path,fignum,figname,txt):
         txt = str(txt)
-        x = [city.x[0] for city in cities]
-        x.append(x[0])
-        y = [city.x[1] for city in cities]
-        y.append(y[0])
+        x = np.append(path[:,0],path[0,0])
+        y = np.append(path[:,1],path[0,1])
         plt.figure(fignum)
         plt.plot(x, y)
         plt.scatter(x, y)
@@ -186,16 +261,15 @@ if __name__ == "__main__":
     mapsize = 100
     maxx = upperrightpos = [mapsize,mapsize]
 
-    # Randomly assign positions for N cities.
-    # If the Python random number generator does not change,
-    # the best solution to this problem found so far is E = 680.35571.
+    # Randomly assign positions for N cities. The fixed seed gives the
+    # same map on every run.
     ranseed = 9797973
     random.seed(ranseed)
     x = [random.random() * (maxx[0] - minx[0]) + minx[0]
          for i in range(N)]
     y = [random.random() * (maxx[1] - minx[1]) + minx[1]
          for i in range(N)]
-    cities = [City([a,b]) for a,b in zip(x,y)]
+    coords = np.stack([x,y],axis=1)
 
     # If use_dE then system will use the energy_change method
     # rather than the full energy method
@@ -206,12 +280,11 @@ if __name__ == "__main__":
     use_parallel = True
 
     # Create the system
-    sys = System(N,cities,use_dE)
+    sys = System(N,coords,use_dE)
     print("Starting System: ")
     energy = sys.get_energy()
     print("Energy = ",energy)
-    cities = sys.get_cities()
-    dump(cities,0,"Start",energy)
+    dump(sys.get_path(),0,"Start",energy)
 
     # Set up the Annealing schedule and the Simulation
     schedule = mcsled.AnnealingSchedule(Ti=10,Tf=0.001,reduce=0.99,
@@ -242,17 +315,16 @@ if __name__ == "__main__":
             xsys.set_saved_state()
             E = xsys.get_energy()
             print("E = ",E)
-            cities = xsys.get_cities()
-            dump(cities,i + 1,"Final" + str(i),E)
+            path = xsys.get_path()
+            dump(path,i + 1,"Final" + str(i),E)
             if E < lowE:
                 lowE = E
-                bestcities = cities
-        dump(bestcities,i + 2,"Best",lowE)
+                bestpath = path
+        dump(bestpath,i + 2,"Best",lowE)
         print("Lowest Energy over parallel runs:",lowE)
     else:
         sys.set_saved_state()
         print("Best System at end: ")
         E = sys.get_energy()
         print("Energy = ",E)
-        cities = sys.get_cities()
-        dump(cities,1,"Best",E)
+        dump(sys.get_path(),1,"Best",E)
@@ -0,0 +1,99 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+""" Optional compiled step loop for MCSim, used for Python-move systems when
+    numba's whole-block path (use_numba) does not apply.
+    The moves and energy functions are still Python calls, but the move
+    choice, the Metropolis test and the bookkeeping run in C.
+    Build in place with:  cythonize -i _fast.pyx
+    MCSim uses it, unless use_fast is set False, when this build sits next
+    to mcsled.py and its API_VERSION matches mcsled's.
+"""
+
+from libc.math cimport exp
+
+import numpy as np
+
+# Checked by mcsled on import; bump it whenever run_steps changes signature.
+API_VERSION = 3
+
+
+cpdef tuple run_steps(const double[:, ::1] rands,double T,double Enew,
+                      double lowE,bint track_lowE,bint use_dE,list moves,
+                      list accepts_uniforms,const double[::1] cum,
+                      bint use_alias,const double[::1] alias_prob,
+                      const Py_ssize_t[::1] alias_alt,object decide,
+                      object energy,object energy_change,object commit,
+                      object save_state,list ntrial,list naccept):
+    """ One Monte Carlo step for each row of uniforms in rands, as in
+    MCSim.run_steps. decide is None for the stock Metropolis test, which
+    is then done here, exactly as in run_steps. ntrial and naccept are
+    updated in place. Returns the final and the lowest energies.
+    """
+    cdef Py_ssize_t nsteps = rands.shape[0]
+    cdef Py_ssize_t nmoves = len(moves)
+    cdef Py_ssize_t istep, imove, lo, hi, mid
+    cdef double Eold, dE, x, u1
+    cdef bint accept
+    cdef Py_ssize_t[::1] nt = np.zeros(nmoves,dtype=np.intp)
+    cdef Py_ssize_t[::1] na = np.zeros(nmoves,dtype=np.intp)
+    cdef int[::1] uniforms = np.array(accepts_uniforms,dtype=np.intc)
+
+    for istep in range(nsteps):
+        Eold = Enew
+        # choose the move type, as in MCSim.choose_move
+        x = rands[istep,0]
+        if use_alias:
+            x = x * nmoves
+            imove = <Py_ssize_t>x
+            if x - imove >= alias_prob[imove]:
+                imove = alias_alt[imove]
+        else:
+            lo = 0
+            hi = cum.shape[0]
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if cum[mid] < x:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            imove = min(lo,cum.shape[0] - 1)
+        moveobj = moves[imove]
+        if uniforms[imove]:
+            moveobj.trial_move(rands[istep,2],rands[istep,3])
+        else:
+            moveobj.trial_move()
+        nt[imove] += 1
+
+        u1 = rands[istep,1]
+        if use_dE:
+            # the system is only changed if the move is accepted
+            dE = energy_change(moveobj)
+        else:
+            # change the system, and change it back if rejected
+            moveobj.make_move()
+            Enew = energy()
+            dE = Enew - Eold
+        if decide is not None:
+            accept = decide(dE,T)
+        else:
+            accept = dE <= 0.0 or u1 <= exp(- dE / T)
+
+        if accept:
+            na[imove] += 1
+            if use_dE:
+                moveobj.make_move()
+                Enew = Eold + dE
+            if commit is not None:
+                commit(dE)
+        elif not use_dE:
+            Enew = Eold
+            moveobj.unmake_move()
+
+        if track_lowE and Enew < lowE:
+            lowE = Enew
+            if save_state is not None:
+                save_state()
+
+    for imove in range(nmoves):
+        ntrial[imove] += nt[imove]
+        naccept[imove] += na[imove]
+    return Enew, lowE
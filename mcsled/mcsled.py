@@ -14,7 +14,13 @@
             (4) get_probability(), which provides (unnormalized)
             probability for that move.
         These methods are all called without arguments, so their parent object
-        must handle their state and any required inputs.
+        must handle their state and any required inputs. The one exception:
+        a move with an attribute accepts_uniforms = True has trial_move
+        called as trial_move(u1, u2), with two uniform random numbers on
+        [0,1) taken from the batches MCSim draws for each MC block.
+        A move may also have a scale attribute, a multiplier on its step
+        size, which MCSim adjusts after each block when the schedule has a
+        target_accept rate (not in the use_numba path).
 
         B: get_energy() method which returns the total energy of the system,
         given its current state. Also called without arguments.
@@ -26,7 +32,11 @@
         D: Optionally, a save_state() method which saves a copy
         of the current state as an attribute of the input system object.
         This will be used to hold the lowest energy state found during
-        the MC simulation.
+        the MC simulation. Errors raised by save_state are not caught.
+        It is called at each new lowest energy, so it should copy the state
+        with ndarray.copy() or a slice, not copy.deepcopy. If the system
+        has a state_array (see G), MCSim instead keeps the lowest state in
+        a preallocated array and calls save_state once per MC block.
 
         E: Optionally, a get_energy_change(move) method which calculates
         the change in energy due to a trial move object rather than calculating
@@ -35,6 +45,50 @@
         also set an attribute of the system object, use_dE, to be True.
         The get_energy_change routine will be passed the chosen move object
         by the annealing simulation.
+        Without it every step recomputes the whole energy, so MCSim warns
+        (PerformanceWarning) for systems larger than max_full_energy_size.
+        A system whose get_energy is cheap at any size, such as a function
+        of a few variables where get_size only sets the cycle length, can
+        set an attribute cheap_energy to True to skip the warning.
+        For a move that changes a few parts of the system, dE needs only
+        the energy terms that involve those parts: the set P- of terms
+        before the move and P+ after it, dE = sum(P+) - sum(P-). The
+        IncrementalMove base class (below) keeps the indices of the parts
+        a trial move changes for get_energy_change to use.
+
+        F: Optionally, a commit(dE) method, which is called with the energy
+        change each time a move is accepted. A system can use this to keep
+        a running total energy, so that get_energy need not recompute it.
+        In the use_numba path (see G) the steps run compiled, so commit is
+        called once per MC block with the total energy change of the block.
+        A running total drifts by rounding error; recompute it from the
+        state now and then, e.g. in save_state.
+
+        G: Optionally, a compiled (numba) fast path that runs each whole MC
+        block in a single @njit kernel. To use it, set use_numba (and use_dE)
+        to True, give each move a get_params() method returning a sequence
+        of floats (the same length for every move), and provide:
+            (1) state_array, an ndarray holding the full state of the
+            system, which the kernels change in place.
+            (2) get_numba_kernels(), which returns three @njit functions
+            (trial_move, energy_change, make_move) with signatures
+                trial_move(state, params, trial, rng)
+                energy_change(state, trial) -> dE
+                make_move(state, trial)
+            where state is state_array, params is the chosen move's
+            get_params() as a float64 array, and trial is a float64
+            scratch array, the same length as state, which trial_move fills
+            with the move parameters. trial_move should draw its random
+            numbers from rng, the MCSim's own numpy Generator, e.g.
+            rng.random(), rather than from np.random's global state.
+        The Python move methods are then not called during MC blocks.
+
+        For other systems, if the optional Cython extension _fast has been
+        built (cythonize -i _fast.pyx), MC blocks run its step loop, which
+        still calls the Python moves but chooses moves and does the
+        Metropolis test in C.
+        A state_array alone, without use_numba, is used only to keep the
+        lowest energy state (see D).
 
 
     2. An instance of the AnnealingSchedule class (defined in this module)
@@ -44,7 +98,260 @@
 
 import random
 import math
+import copy
+import bisect
+import functools
+import itertools
+import importlib.machinery
+import importlib.util
+import os
+import warnings
+from math import exp as _exp, log as _log, inf as _inf
 import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; kernels then run as plain Python
+    def njit(*args,**kwargs):
+        """ Stand-in for numba.njit: returns the function undecorated. """
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+
+# The run_steps signature this module calls in the _fast extension.
+_FAST_API_VERSION = 3
+
+
+def _load_fast():
+    """ Import the optional Cython step loop, _fast, built next to this
+    file. No other directory is searched, so an unrelated _fast module on
+    sys.path is never picked up. A build with a different API_VERSION is
+    stale: it is ignored, with a PerformanceWarning. Returns None if there
+    is no usable _fast.
+    """
+    if __package__:
+        try:
+            module = importlib.import_module("._fast",__package__)
+        except ImportError:
+            return None
+    else:
+        # mcsled.py imported as a top-level module
+        here = os.path.dirname(os.path.abspath(__file__))
+        spec = importlib.machinery.PathFinder.find_spec("_fast",[here])
+        if spec is None:
+            return None
+        module = importlib.util.module_from_spec(spec)
+        try:
+            spec.loader.exec_module(module)
+        except ImportError:
+            return None
+    if getattr(module,"API_VERSION",None) != _FAST_API_VERSION:
+        warnings.warn("the _fast extension at {} does not match this "
+                      "mcsled; rebuild it with cythonize -i _fast.pyx. Using "
+                      "the Python step loop.".format(module.__file__),
+                      PerformanceWarning,stacklevel=2)
+        return None
+    return module
+
+
+class PerformanceWarning(UserWarning):
+    """ Warns of a setup that will make a simulation needlessly slow. """
+
+
+_fast = _load_fast()
+
+
+@njit(cache=True,fastmath=True)
+def _metropolis(dE,T,x):
+    """ Compiled Metropolis test for an uphill move, dE > 0,
+    given a uniform random number x, for the use_numba block kernel.
+    Done in the log domain, x <= exp(-dE/T) <=> -dE >= T*log(x), which
+    needs no division and cannot overflow. x == 0.0 is always accepted.
+    """
+    return x == 0.0 or - dE >= T * _log(x)
+
+
+# exp(-r) tabulated on [0,_EXP_LUT_RMAX] for _metropolis_lut. Beyond that
+# range exp(-r) < 2e-22, so uphill moves there are simply rejected.
+_EXP_LUT_RMAX = 50.0
+_EXP_LUT = np.exp(-np.linspace(0.0,_EXP_LUT_RMAX,1024))
+
+
+@njit(cache=True,fastmath=True)
+def _metropolis_lut(dE,T,x):
+    """ Metropolis test for an uphill move, dE > 0, given a uniform random
+    number x, with exp(-dE/T) linearly interpolated from _EXP_LUT.
+    The relative error in the acceptance probability is below 1e-3.
+    """
+    r = dE / T
+    if r >= _EXP_LUT_RMAX:
+        return False
+    f = r * ((len(_EXP_LUT) - 1) / _EXP_LUT_RMAX)
+    i = int(f)
+    p = _EXP_LUT[i] + (f - i) * (_EXP_LUT[i + 1] - _EXP_LUT[i])
+    return bool(x <= p)
+
+
+def _alias_table(probabilities):
+    """ Build Walker's alias table for the normalized move probabilities.
+    Index i is then chosen with one uniform pick of a column c and one
+    compare: i = c if u < prob[c] else alt[c].
+    Returns the prob and alt arrays.
+    """
+    k = len(probabilities)
+    prob = np.ones(k)
+    alt = np.arange(k)
+    scaled = [p * k for p in probabilities]
+    small = [i for i,s in enumerate(scaled) if s < 1.0]
+    large = [i for i,s in enumerate(scaled) if s >= 1.0]
+    while small and large:
+        s = small.pop()
+        g = large.pop()
+        prob[s] = scaled[s]
+        alt[s] = g
+        scaled[g] = scaled[g] + scaled[s] - 1.0
+        if scaled[g] < 1.0:
+            small.append(g)
+        else:
+            large.append(g)
+    # anything left over is 1.0 up to rounding, and keeps prob = 1
+    return prob, alt
+
+
+@njit
+def _mc_block_kernel(rng,state,best,move_params,alias_prob,alias_alt,
+                     nsteps,T,Enew,lowE,exp_lut,
+                     trial_move,energy_change,make_move):
+    """ Compiled MC block for use_numba systems (see G above).
+    Picks moves from the alias table, applies the Metropolis test, and
+    copies state into best whenever a new lowest energy is reached.
+    All random numbers come from the numpy Generator rng.
+    exp_lut selects _metropolis_lut over _metropolis.
+    Returns the final and the lowest energies.
+    """
+    nmoves = len(alias_prob)
+    trial = np.empty(len(state))
+    for istep in range(nsteps):
+        imove = int(rng.random() * nmoves)
+        if rng.random() >= alias_prob[imove]:
+            imove = alias_alt[imove]
+        trial_move(state,move_params[imove],trial,rng)
+        dE = energy_change(state,trial)
+        if dE <= 0.0:
+            accept = True
+        elif exp_lut:
+            accept = _metropolis_lut(dE,T,rng.random())
+        else:
+            accept = _metropolis(dE,T,rng.random())
+        if accept:
+            make_move(state,trial)
+            Enew += dE
+            if Enew < lowE:
+                lowE = Enew
+                best[:] = state
+    return Enew, lowE
+
+
+def _seed_sequence(ranseed):
+    """ A numpy SeedSequence for ranseed, an int or a SeedSequence. Without
+    one, the seed is drawn from the random module, so seeding that still
+    makes runs reproducible.
+    """
+    if isinstance(ranseed,np.random.SeedSequence):
+        return ranseed
+    if ranseed is None:
+        return np.random.SeedSequence(random.getrandbits(64))
+    return np.random.SeedSequence(ranseed)
+
+
+# The system and schedule for Replicates workers, set in each worker process
+# by _init_worker.
+_replicate = {}
+
+
+def _get_attr_path(obj,name):
+    """ getattr for a dotted attribute path, such as "energy.D". """
+    for part in name.split("."):
+        obj = getattr(obj,part)
+    return obj
+
+
+def _set_attr_path(obj,name,value):
+    """ setattr for a dotted attribute path, such as "energy.D". """
+    *path,last = name.split(".")
+    for part in path:
+        obj = getattr(obj,part)
+    setattr(obj,last,value)
+
+
+def _init_worker(system,schedule,attach):
+    """ Pool initializer for Replicates: keeps the system and schedule for
+    _worker. With the fork start method these are inherited, not pickled.
+    Otherwise (attach True) any arrays placed in shared memory by
+    Replicates.share_numpy are reattached here, so the workers use the
+    shared pages rather than their pickled copies.
+    """
+    shared_arrays = getattr(system,"shared_arrays",{}) if attach else {}
+    for name,(shmname,shape,dtype) in shared_arrays.items():
+        shm = shared_memory.SharedMemory(name=shmname)
+        _replicate[name] = shm  # the buffer lives as long as shm does
+        _set_attr_path(system,name,
+                       np.ndarray(shape,dtype=dtype,buffer=shm.buf))
+    _replicate["system"] = system
+    _replicate["schedule"] = schedule
+
+
+def _worker(i,ranseed):
+    """ Build an MCSim in the worker process and run replicate i. A worker
+    may run several replicates, so each starts from its own copy of the
+    system; the shared arrays are not copied.
+    """
+    system = _replicate["system"]
+    shared = (_get_attr_path(system,name)
+              for name in getattr(system,"shared_arrays",{}))
+    system = copy.deepcopy(system,{id(arr): arr for arr in shared})
+    sim = MCSim(system,_replicate["schedule"],ranseed=ranseed)
+    return sim.anneal_parallel(i)
+
+
+class IncrementalMove:
+    """ Optional base class for moves of use_dE systems.
+    trial_move stores the indices of the parts of the system the trial
+    move will change, from affected_indices(), in self.indices. The
+    system's get_energy_change(move) can then sum only the energy terms
+    involving move.indices before (P-) and after (P+) the move, and
+    make_move and unmake_move can change only those parts.
+    Subclasses provide affected_indices, make_move and unmake_move, and
+    set any other move parameters in affected_indices. A subclass with
+    accepts_uniforms gets the two uniforms in affected_indices(u1, u2).
+    The Move of examples/MC1D.py is one.
+    """
+
+    def __init__(self,probability=1.0):
+        self.probability = probability
+        self.indices = ()
+
+    def affected_indices(self):
+        """ Return the indices of the parts of the system changed by the
+        next trial move.
+        """
+        raise NotImplementedError
+
+    def trial_move(self,*uniforms):
+        self.indices = self.affected_indices(*uniforms)
+
+    def make_move(self):
+        raise NotImplementedError
+
+    def unmake_move(self):
+        raise NotImplementedError
+
+    def get_probability(self):
+        """ Return the (unnormalized) probability for this move. """
+        return self.probability
 
 
 class Replicates():
@@ -55,47 +362,178 @@ class Replicates():
         if integer, taken as number of processes to run
         if float, taken as multiplier on total number of available processors.
         if missing, # proc used will be 85% of those available, rounded down.
+    start_method = [optional] multiprocessing start method for the worker
+        processes. If missing, the platform default: spawn on macOS and
+        Windows, where fork is unsafe; fork on Linux before Python 3.14.
+    Forked workers inherit the system rather than getting a pickled copy
+    of it. Large read-only arrays of the system can be placed in shared
+    memory with share_numpy, which the workers use with any start method.
     """
 
-    def __init__(self,system,schedule,nproc=None,ranseed=None):
+    def __init__(self,system,schedule,nproc=None,ranseed=None,
+                 start_method=None):
         if nproc is None:
-            np = int(0.85 * mp.cpu_count())
+            nprocs = int(0.85 * mp.cpu_count())
         elif isinstance(nproc,int):
-            np = nproc
+            nprocs = nproc
         elif isinstance(nproc,float):
-            np = int(nproc * mp.cpu_count())
-        self.np = np
-        print("Replicates will use {} threads.".format(np))
+            nprocs = int(nproc * mp.cpu_count())
+        self.np = nprocs
+        print("Replicates will use {} threads.".format(nprocs))
         self.system = system
         self.schedule = schedule
-        if ranseed is not None:
-            random.seed(ranseed)
+        self.shared = {}
+        self.start_method = start_method
+        # each replicate's MCSim is seeded from an independent child of this
+        self.seedseq = _seed_sequence(ranseed)
+
+    def share_numpy(self,name,arr):
+        """ Copy the array arr into a shared memory block and set it as
+        attribute name of the system, so that all replicates read the same
+        memory. The array must not be changed during the runs.
+        name may be a dotted path to an attribute of an object the system
+        holds, such as "energy.D" for tspMC's distance matrix. Only the
+        arrays passed here are shared; any others are copied to each
+        worker that is not forked.
+        Returns the shared array.
+        """
+        shm = shared_memory.SharedMemory(create=True,size=max(arr.nbytes,1))
+        shared = np.ndarray(arr.shape,dtype=arr.dtype,buffer=shm.buf)
+        shared[...] = arr
+        self.shared[name] = shm
+        if not hasattr(self.system,"shared_arrays"):
+            self.system.shared_arrays = {}
+        self.system.shared_arrays[name] = (shm.name,arr.shape,arr.dtype)
+        _set_attr_path(self.system,name,shared)
+        return shared
+
+    def release_shared(self):
+        """ Free the shared memory blocks made by share_numpy, giving the
+        system private copies of the arrays.
+        """
+        for name,shm in self.shared.items():
+            _set_attr_path(self.system,name,
+                           np.array(_get_attr_path(self.system,name)))
+            del self.system.shared_arrays[name]
+            shm.close()
+            shm.unlink()
+        self.shared = {}
 
     def run(self):
         """ Sets up the pool of worker processes and runs the annealing method
         in each.
         """
-        # each anneal_parallel method returns the system object after the run
-        pool = mp.Pool(processes=self.np)
-        # These ranseeds do NOT seem to get the child processes to have
-        # consistent ran number sequences in different runs.
-        ranseeds = [int(random.random() * 1000000) for i in range(self.np)]
-        print("Random number seeds: ")
-        for r in ranseeds:
-            print(r)
-        results = [pool.apply_async(MCSim(self.system,self.schedule,
-                                    ranseed=ranseeds[i]).
-                                    anneal_parallel,args=(i,))
-                   for i in range(self.np)]
-        output = [p.get() for p in results]
+        ctx = mp.get_context(self.start_method)
+        # Child seed sequences give independent, reproducible streams.
+        ranseeds = self.seedseq.spawn(self.np)
+        print("Random number seed: ",self.seedseq.entropy)
+        # each worker builds its own MCSim and returns the system after the run
+        with ctx.Pool(processes=self.np,initializer=_init_worker,
+                      initargs=(self.system,self.schedule,
+                                ctx.get_start_method() != "fork")) as pool:
+            output = pool.starmap(_worker,[(i,ranseeds[i])
+                                           for i in range(self.np)])
         return output
 
 
+class ParallelTempering():
+    """ Parallel tempering (replica exchange): replicas of the system run
+    MC blocks at a ladder of fixed temperatures, T_k = Ti * reduce**k, and
+    after each round of blocks configurations at neighbouring temperatures
+    are swapped with the Metropolis probability
+        min(1, exp((1/T_k - 1/T_k+1) * (E_k - E_k+1))).
+    A swap exchanges which replica runs at which temperature, which is the
+    same as exchanging their configurations.
+    system = System object containing get_energy etc. methods. Each replica
+        runs on a deep copy of it.
+    schedule = AnnealingSchedule object; Ti, reduce and ncycles are used.
+    nreplicas = [optional] number of temperatures. If missing, the ladder
+        runs down to Tf.
+    The replicas run in turn in this process. Each has its own numpy
+    Generator, spawned from ranseed; the global random state is not seeded.
+    """
+
+    def __init__(self,system,schedule,nreplicas=None,ranseed=None):
+        if nreplicas is None:
+            nreplicas = int(math.log(schedule.Tf / schedule.Ti) /
+                            math.log(schedule.reduce)) + 1
+        self.temperatures = [schedule.Ti * schedule.reduce**k
+                             for k in range(nreplicas)]
+        seeds = _seed_sequence(ranseed).spawn(nreplicas + 1)
+        self.systems = [copy.deepcopy(system) for k in range(nreplicas)]
+        self.sims = [MCSim(self.systems[k],schedule,ranseed=seeds[k],
+                           seed_random=False)
+                     for k in range(nreplicas)]
+        self._rng = np.random.default_rng(seeds[-1])
+        # order[k] is the replica at temperature k
+        self.order = list(range(nreplicas))
+        self.nswaps = [0] * (nreplicas - 1)
+        self.nrounds = 0
+        self.lowE = 1.0 / MCSim.tiny
+
+    def run(self,nrounds):
+        """ Runs nrounds rounds of one MC block per replica followed by swap
+        attempts between neighbouring temperatures. Each replica saves its
+        own lowest energy state. Returns the list of replica systems.
+        """
+        print("------------------- Tempering Start -----------------------")
+
+        temps = self.temperatures
+        sims = self.sims
+        order = self.order
+        energies = [sim.energy() for sim in sims]
+        for sim,E in zip(sims,energies):
+            if E < sim.lowE:
+                sim.lowE = E
+                if sim.save_state is not None:
+                    sim.save_state()
+        nsteps = sims[0].size * sims[0].ncycles
+
+        for iround in range(nrounds):
+            for k,T in enumerate(temps):
+                i = order[k]
+                energies[i] = sims[i].mc_block(nsteps,T,energies[i])
+            for k in range(len(temps) - 1):
+                i = order[k]
+                j = order[k + 1]
+                delta = (1.0 / temps[k] - 1.0 / temps[k + 1]) * \
+                    (energies[i] - energies[j])
+                if delta >= 0.0 or self._rng.random() < _exp(delta):
+                    order[k] = j
+                    order[k + 1] = i
+                    self.nswaps[k] += 1
+            self.nrounds += 1
+
+        self.lowE = min(sim.lowE for sim in sims)
+        print("------------------- Tempering Finish ----------------------")
+        return self.systems
+
+
 class MCSim:
 
     tiny = 1.0e-16
-
-    def __init__(self,system,schedule,ranseed=None):
+    # Uniform random numbers for mc_block are drawn in batches of this
+    # many steps: two per step (move choice and acceptance), and two more
+    # only if some move has accepts_uniforms.
+    nrands = 4096
+    # Move types are chosen by binary search of the cumulative probabilities
+    # for up to this many moves, and from an alias table for more.
+    max_search_moves = 4
+    # In the compiled use_numba kernel, uphill moves are accepted using a
+    # table of exp(-dE/T) (_metropolis_lut) rather than the exact test. Set
+    # False for exact Metropolis statistics. The Python and _fast step loops
+    # always use the exact test, which costs no more than a table there.
+    exp_lut = True
+    # Run Python-move MC blocks with the compiled _fast step loop, if built.
+    use_fast = _fast is not None
+    # Systems larger than this without use_dE get a PerformanceWarning.
+    max_full_energy_size = 32
+    # Keep the per-block Thistory and Eblockhistory lists. Off by default,
+    # since the early-stop check does not need them.
+    record_history = False
+
+    def __init__(self,system,schedule,ranseed=None,bitgen=None,
+                 seed_random=True):
         self.lowE = 1.0 / self.tiny
         self.Ti = schedule.Ti
         self.Tf = schedule.Tf
@@ -105,95 +543,315 @@ class MCSim:
         self.system = system
         self.moves = system.get_moves()
         self.energy = system.get_energy
-        if ranseed is not None:
-            random.seed(ranseed)
+        # ranseed may be an int or a numpy SeedSequence (see _seed_sequence).
+        # The random numbers come from a numpy Generator on bitgen if given,
+        # else on PCG64. The compiled use_numba kernels draw from the same
+        # Generator.
+        seedseq = _seed_sequence(ranseed)
+        if bitgen is not None:
+            self._rng = np.random.Generator(bitgen)
+        else:
+            self._rng = np.random.default_rng(seedseq)
+        if ranseed is not None and seed_random:
+            # also seed the random module, which some moves use; with
+            # seed_random False (as for ParallelTempering replicas) the
+            # global state is left alone
+            random.seed(int(seedseq.generate_state(1)[0]))
         if system.use_dE:
             self.energy_change = system.get_energy_change
+        self.commit = getattr(system,"commit",None)
+        self.save_state = getattr(system,"save_state",None)
         self.size = system.get_size()
+        if (not system.use_dE and self.size > self.max_full_energy_size
+                and not getattr(system,"cheap_energy",False)):
+            warnings.warn("use_dE is False, so every MC step recomputes the "
+                          "full energy with get_energy(); implement "
+                          "get_energy_change() for large systems.",
+                          PerformanceWarning,stacklevel=2)
         # convert move weights/propabilities to cumulative probabilities
-        mysum = 0.0
-        mysum = sum([move.get_probability() for move in self.moves])
-        probabilities = [move.get_probability() / mysum for move in self.moves]
-        self.cummoveprobabilities = [sum(probabilities[0:i + 1])
-                                     for i in range(len(probabilities))]
-        self.Thistory = []
-        self.Eblockhistory = []
-
-    def choose_move(self):
-        """ chooses next move type based on cumulative probabilities """
-        x = random.random()
-        for i,p in enumerate(self.cummoveprobabilities):
-            if x <= p:
+        probabilities = np.array([move.get_probability()
+                                  for move in self.moves],dtype=np.float64)
+        probabilities /= probabilities.sum()
+        # Kept as a list: bisect on a list is much faster than
+        # np.searchsorted for one value at a time.
+        self.cummoveprobabilities = np.cumsum(probabilities).tolist()
+        self.alias_prob, self.alias_alt = _alias_table(probabilities.tolist())
+        self.nmoves = len(self.moves)
+        self.accepts_uniforms = [getattr(move,"accepts_uniforms",False)
+                                 for move in self.moves]
+        # uniforms drawn per step: see run_steps
+        self.ncolumns = 4 if any(self.accepts_uniforms) else 2
+        # trials and acceptances of each move in the current block
+        self.ntrial = [0] * self.nmoves
+        self.naccept = [0] * self.nmoves
+        self.target_accept = getattr(schedule,"target_accept",None)
+        self.use_alias = self.nmoves > self.max_search_moves
+        # With a state_array, the lowest state is copied into best_state,
+        # with no allocation, and handed to save_state once per block.
+        self.state_array = getattr(system,"state_array",None)
+        if self.state_array is not None:
+            self.best_state = np.copy(self.state_array)
+            self._fast_save = functools.partial(np.copyto,self.best_state,
+                                                self.state_array)
+        else:
+            self._fast_save = None
+        self.use_numba = getattr(system,"use_numba",False)
+        if self.use_numba:
+            self.kernels = system.get_numba_kernels()
+            self.move_params = np.array([move.get_params()
+                                         for move in self.moves],
+                                        dtype=np.float64)
+        self.new_history(0)
+        # lowE at the start of the current run of blocks within threshold
+        # of it, and the number of blocks in that run
+        self.stopE = None
+        self.nstagnant = 0
+
+    def choose_move(self,u=None):
+        """ chooses next move type based on the move probabilities.
+        u is an optional uniform random number to use for the choice.
+        """
+        if u is None:
+            u = self._rng.random()
+        if self.use_alias:
+            # the integer part of u*nmoves picks the column, and the
+            # fractional part is the uniform for the alias test
+            x = u * self.nmoves
+            i = int(x)
+            if x - i < self.alias_prob[i]:
                 return i
-
-    def decide(self,dE,T):
-        """ Returns T or F for Metropolis acceptance criterion """
+            return int(self.alias_alt[i])
+        i = bisect.bisect_left(self.cummoveprobabilities,u)
+        # the last cumulative probability may round to just below 1
+        return min(i,len(self.cummoveprobabilities) - 1)
+
+    def decide(self,dE,T,u=None):
+        """ Returns T or F for Metropolis acceptance criterion.
+        u is an optional uniform random number to use for the test.
+        """
         if dE <= 0.0:
             return True
-        x = random.random()
-        if x <= math.exp(- dE / T):
-            return True
+        if u is None:
+            u = self._rng.random()
+        return u <= _exp(- dE / T)
+
+    def mc_step(self,T,Enew,u=None):
+        """ one step of the Monte Carlo simulation.
+        u is an optional sequence of ncolumns uniform random numbers for
+        the step; if missing, they are drawn here.
+        """
+        if u is None:
+            u = self._rng.random(self.ncolumns)
+        return self.run_steps(np.reshape(u,(1,-1)),T,Enew,track_lowE=False)
+
+    def run_steps(self,rands,T,Enew,track_lowE=True):
+        """ Runs one Monte Carlo step for each row of uniform random
+        numbers in the (nsteps,ncolumns) array rands, at T Temperature,
+        starting from energy Enew. The columns are the move choice, the
+        acceptance test, and, if any move has accepts_uniforms, the two
+        uniforms for its trial_move.
+        If track_lowE, lowE is updated (and the state saved) at each new low.
+        Methods and flags are bound to local names once per call, so the
+        step loop does no attribute lookups on self, and the choose_move
+        logic is inlined.
+        """
+#        print("-------------top of run_steps------------------")
+
+        use_dE = self.system.use_dE
+        moves = self.moves
+        nmoves = self.nmoves
+        accepts_uniforms = self.accepts_uniforms
+        use_alias = self.use_alias
+        cum = self.cummoveprobabilities
+        ilast = len(cum) - 1
+        # Python lists index much faster than ndarrays element by element.
+        alias_prob = self.alias_prob.tolist()
+        alias_alt = self.alias_alt.tolist()
+        bisect_left = bisect.bisect_left
+        # The stock decide is inlined: downhill moves are accepted, and
+        # uphill ones tested with a plain exp, which is much cheaper than a
+        # call to a compiled function. A replaced decide is called, as
+        # decide(dE,T), for every move, since no dE passes dE <= -inf.
+        if getattr(self.decide,"__func__",None) is MCSim.decide:
+            downhill = 0.0
+            decide = None
         else:
-            return False
-
-    def mc_step(self,T,Enew):
-        """ one step of the Monte Carlo simulation """
-#        print("-------------top of mc_step------------------")
-
-        Eold = Enew
-        imove = self.choose_move()
-        moveobj = self.moves[imove]  # get the move
-        moveobj.trial_move()  # set the move parameters
-
-        if self.system.use_dE:
-            dE = self.energy_change(moveobj)
+            downhill = -_inf
+            decide = self.decide
+        exp = _exp
+        energy = self.energy
+        energy_change = self.energy_change if use_dE else None
+        commit = self.commit
+        if self._fast_save is not None:
+            save_state = self._fast_save
         else:
-            self.moves[imove].make_move()   # actually change the system
-            Enew = self.energy()
-            dE = Enew - Eold
-
-        decision = self.decide(dE,T)
-        if decision:
-            #  accepted
-            if self.system.use_dE:
-                self.moves[imove].make_move()   # actually change the system
-                Enew = Enew + dE
-            else:
-                pass  # already changed
+            save_state = self.save_state
+        lowE = self.lowE
+        ntrial = self.ntrial
+        naccept = self.naccept
+        # Python lists index much faster than ndarrays element by element,
+        # and a column at a time avoids a list per step.
+        choices = rands[:,0].tolist()
+        accepts = rands[:,1].tolist()
+        if rands.shape[1] > 2:
+            uniforms = rands[:,2:].tolist()
         else:
-            # rejected
-            if self.system.use_dE:
-                pass  # do nothing, system not changed
+            uniforms = itertools.repeat(None)
+
+        for uc, ua, uu in zip(choices,accepts,uniforms):
+            Eold = Enew
+            # choose the move type, as in choose_move
+            if use_alias:
+                x = uc * nmoves
+                imove = int(x)
+                if x - imove >= alias_prob[imove]:
+                    imove = alias_alt[imove]
             else:
-                Enew = Eold
-                self.moves[imove].unmake_move()  # change the system back
-
-#        print("-------------bottom of mc_step------------------")
+                imove = min(bisect_left(cum,uc),ilast)
+            moveobj = moves[imove]  # get the move
+            # set the move parameters
+            if accepts_uniforms[imove]:
+                moveobj.trial_move(uu[0],uu[1])
+            else:
+                moveobj.trial_move()
+            ntrial[imove] += 1
+
+            if use_dE:
+                # the system is only changed if the move is accepted
+                dE = energy_change(moveobj)
+                if dE <= downhill or (ua <= exp(- dE / T) if decide is None
+                                      else decide(dE,T)):
+                    naccept[imove] += 1
+                    moveobj.make_move()
+                    Enew = Eold + dE
+                    if commit is not None:
+                        commit(dE)
+            else:
+                # change the system, and change it back if rejected
+                moveobj.make_move()
+                Enew = energy()
+                dE = Enew - Eold
+                if dE <= downhill or (ua <= exp(- dE / T) if decide is None
+                                      else decide(dE,T)):
+                    naccept[imove] += 1
+                    if commit is not None:
+                        commit(dE)
+                else:
+                    Enew = Eold
+                    moveobj.unmake_move()
+
+            if track_lowE and Enew < lowE:
+                lowE = Enew
+                if save_state is not None:
+                    save_state()
+
+#        print("-------------bottom of run_steps------------------")
+
+        self.lowE = lowE
+        return Enew
 
-        self.Enew = Enew
+    def run_steps_fast(self,rands,T,Enew):
+        """ run_steps, with lowE tracking, in the compiled _fast step loop.
+        rands is as for run_steps.
+        """
+        if getattr(self.decide,"__func__",None) is MCSim.decide:
+            decide = None  # done in C
+        else:
+            decide = self.decide
+        use_dE = self.system.use_dE
+        if self._fast_save is not None:
+            save_state = self._fast_save
+        else:
+            save_state = self.save_state
+        Enew, self.lowE = _fast.run_steps(
+            rands,T,Enew,self.lowE,True,use_dE,self.moves,
+            self.accepts_uniforms,np.asarray(self.cummoveprobabilities),
+            self.use_alias,self.alias_prob,
+            self.alias_alt.astype(np.intp),decide,self.energy,
+            self.energy_change if use_dE else None,self.commit,save_state,
+            self.ntrial,self.naccept)
         return Enew
 
     def mc_block(self,nsteps,T,Enew):
         """ A block of Monte Carlo: runs for nsteps number of steps
         at T Temperature. Assumes system energy Enew is correct on input.
+        The random numbers for the steps are drawn from numpy in batches
+        of nrands steps rather than one call at a time.
         """
 #        print("-------------top of block------------------")
 #        print("T = ",T,"     Enew = ",Enew)
 
-        for istep in range(nsteps):
-            Enew = self.mc_step(T,Enew)
+        if self.use_numba:
+            Enew = self.mc_block_numba(nsteps,T,Enew)
+            self.Enew = Enew
+            return Enew
+
+        self.ntrial = [0] * self.nmoves
+        self.naccept = [0] * self.nmoves
+        lowE = self.lowE
+        ndone = 0
+        while ndone < nsteps:
+            nbatch = min(self.nrands,nsteps - ndone)
+            rands = self._rng.random((nbatch,self.ncolumns))
+            if self.use_fast:
+                Enew = self.run_steps_fast(rands,T,Enew)
+            else:
+                Enew = self.run_steps(rands,T,Enew)
+            ndone += nbatch
+
+        if self._fast_save is not None and self.lowE < lowE:
+            self.save_best()
 
-            if Enew < self.lowE:
-                self.lowE = Enew
-                try:
-                    self.system.save_state()
-                except Exception:
-                    pass
+        if self.target_accept is not None:
+            self.adapt_moves()
 
 #        print("-------------end of block------------------")
 
+        self.Enew = Enew  # energy at the end of the last block
         return Enew
 
+    def adapt_moves(self):
+        """ Multiplies the scale attribute of each move that has one by
+        exp((rate - target_accept)/5), where rate is the fraction of that
+        move's trials accepted in the last block. Moves without a scale
+        are untouched.
+        """
+        for move,ntrial,naccept in zip(self.moves,self.ntrial,self.naccept):
+            if ntrial > 0 and hasattr(move,"scale"):
+                rate = naccept / ntrial
+                move.scale *= _exp((rate - self.target_accept) / 5.0)
+
+    def mc_block_numba(self,nsteps,T,Enew):
+        """ mc_block for use_numba systems: the whole block runs in one
+        call to the compiled _mc_block_kernel. commit, if the system has
+        one, is called once with the energy change of the whole block.
+        """
+        state = self.state_array
+        Eold = Enew
+        Enew, lowE = _mc_block_kernel(self._rng,state,self.best_state,
+                                      self.move_params,self.alias_prob,
+                                      self.alias_alt,
+                                      nsteps,T,Enew,self.lowE,self.exp_lut,
+                                      *self.kernels)
+        if self.commit is not None and Enew != Eold:
+            self.commit(Enew - Eold)
+        if lowE < self.lowE:
+            self.lowE = lowE
+            self.save_best()
+        return Enew
+
+    def save_best(self):
+        """ Calls the system's save_state with best_state swapped into its
+        state_array.
+        """
+        if self.save_state is not None:
+            # save_state copies the live state, so swap the best one in
+            state = self.state_array
+            current = state.copy()
+            state[:] = self.best_state
+            self.save_state()
+            state[:] = current
+
     def anneal_parallel(self,junk):
         """ This exists just so multiprocessing methods can hand it an arg. """
         return self.anneal()
@@ -211,12 +869,16 @@ class MCSim:
         nstop = self.nstop
 
         iblock = 0
+        self.stopE = None
+        self.nstagnant = 0
+        if self.record_history:
+            # number of blocks in the geometric schedule, plus one to spare
+            nblocks = int(math.log(Tfinal / Tinit) / math.log(reduce)) + 2
+            self.new_history(max(nblocks,1))
         Enew = self.energy()
 
-        try:
-            self.system.save_state()  # save current as lowest energy state
-        except Exception:
-            pass
+        if self.save_state is not None:
+            self.save_state()  # save current as lowest energy state
 
         # A step is one move, A block is ncycles * self.size moves
         nsteps = self.size * ncycles
@@ -237,27 +899,42 @@ class MCSim:
         print("------------------- Anneal Finish -------------------------")
         return self.system
 
+    def new_history(self,nblocks):
+        """ Start empty temperature and low-energy histories, preallocated
+        as float64 arrays for nblocks blocks. Thistory and Eblockhistory
+        are views of the filled part.
+        """
+        self.Tbuffer = np.empty(nblocks)
+        self.Ebuffer = np.empty(nblocks)
+        self.nhistory = 0
+        self.Thistory = self.Tbuffer[:0]
+        self.Eblockhistory = self.Ebuffer[:0]
+
     def check_early_stop(self,iblock,T,nstop,threshold=0):
-        """ Build temperature and low-energy histories and check
-        if low energy has not changed in nblock steps. If it has,
-        exit the annealing run.
+        """ Check if low energy has stayed within threshold for the last
+        nstop blocks. If it has, exit the annealing run.
+        Only a running count of such blocks is kept, so the check is O(1);
+        temperature and low-energy histories are built if record_history.
         """
-        self.Thistory.append(T)
-        self.Eblockhistory.append(self.lowE)
-
-        if iblock > nstop:
-            stopanneal = True
-            nlen = len(self.Eblockhistory)
-            E = self.Eblockhistory[-1]
-            # print("-------------------------------------------------")
-            for i in range(nlen - 1, nlen - nstop - 1, -1):
-                test = (abs(E - self.Eblockhistory[i]) <= threshold)
-                stopanneal = (stopanneal and test)
-            # if stopanneal:
-            #     for i in range(nlen - 1, nlen - nstop - 1, -1):
-            #         print("T = ",self.Thistory[i],
-            #              "E = ",self.Eblockhistory[i])
-            return stopanneal
+        if self.record_history:
+            n = self.nhistory
+            if n == len(self.Tbuffer):
+                # more blocks than preallocated; double the buffers
+                self.Tbuffer = np.concatenate((self.Tbuffer,np.empty(n + 8)))
+                self.Ebuffer = np.concatenate((self.Ebuffer,np.empty(n + 8)))
+            self.Tbuffer[n] = T
+            self.Ebuffer[n] = self.lowE
+            self.nhistory = n + 1
+            self.Thistory = self.Tbuffer[:n + 1]
+            self.Eblockhistory = self.Ebuffer[:n + 1]
+
+        if self.stopE is not None and abs(self.lowE - self.stopE) <= threshold:
+            self.nstagnant += 1
+        else:
+            self.stopE = self.lowE
+            self.nstagnant = 1
+
+        return iblock > nstop and self.nstagnant >= nstop
 
 
 class AnnealingSchedule:
@@ -267,14 +944,18 @@ class AnnealingSchedule:
         reduce: Factor by which temperature is reduced between MC blocks
         ncycles: Number of cycles (= one move for each thing in simulation)
         nstop: Stop simulation if low energy hasn't changed for nstop cycles.
+        target_accept: [optional] Acceptance rate toward which the scale
+            attribute of moves that have one is adjusted after each block.
     """
 
-    def __init__(self,Ti=100.0,Tf=0.01,reduce=0.95,ncycles=100,nstop=25):
+    def __init__(self,Ti=100.0,Tf=0.01,reduce=0.95,ncycles=100,nstop=25,
+                 target_accept=None):
         self.Tf = Tf
         self.Ti = Ti
         self.reduce = reduce
         self.ncycles = ncycles
         self.nstop = nstop
+        self.target_accept = target_accept
 
 # =============================================================================
 # class System:
@@ -9,7 +9,6 @@ only down-hill moves accepted.
 
 import mcsled
 import random
-import copy
 import pytest
 pytestmark = pytest.mark.integration
 
@@ -29,6 +28,8 @@ class System:
         self.maxx = maxxy
         self.saved_state = None
         self.use_dE = False
+        # get_energy is one function evaluation; size is only a cycle length
+        self.cheap_energy = True
         self.size = 10
         if ranseed:
             random.seed(ranseed)
@@ -63,7 +64,7 @@ class System:
 
     def save_state(self):
         """ Make a copy of the current state of the system. """
-        self.saved_state  = copy.deepcopy(self.position)
+        self.saved_state = self.position[:]
 
     def get_saved_state(self):
         """ Return the saved state. """
@@ -71,7 +72,7 @@ class System:
 
     def set_saved_state(self):
         """ Set the saved state to the current state. """
-        self.position = copy.deepcopy(self.saved_state)
+        self.position[:] = self.saved_state
 
 
 class Move:
@@ -88,6 +89,8 @@ class Move:
         self.minxy = minxy
         self.maxxy = maxxy
         self.pos = system_position
+        self.oldx = None
+        self.oldy = None
         self.dx = None
         self.dy = None
 
@@ -97,23 +100,26 @@ class Move:
         # print("trial dx,dy: ",self.dx,self.dy)
 
     def make_move(self):
-        """ Actually displace the point. """
-        self.pos[0] += self.dx
-        if self.pos[0] > self.maxxy:
-            self.pos[0] = self.maxxy
-        if self.pos[0] < self.minxy:
-            self.pos[0] = self.minxy
-        self.pos[1] += self.dy
-        if self.pos[1] > self.maxxy:
-            self.pos[1] = self.maxxy
-        if self.pos[1] < self.minxy:
-            self.pos[1] = self.minxy
+        """ Actually displace the point, clamped to [minxy,maxxy]. """
+        # Conditional expressions on Python floats: in CPython they cost a
+        # fraction of the builtin min/max calls they replace.
+        pos = self.pos
+        lo = self.minxy
+        hi = self.maxxy
+        self.oldx = oldx = pos[0]
+        self.oldy = oldy = pos[1]
+        x = oldx + self.dx
+        y = oldy + self.dy
+        pos[0] = lo if x < lo else hi if x > hi else x
+        pos[1] = lo if y < lo else hi if y > hi else y
         # print("displaced point: ",self.pos[0],self.pos[1])
 
     def unmake_move(self):
-        """ Move it back in case of move rejection. """
-        self.pos[0] -= self.dx
-        self.pos[1] -= self.dy
+        """ Move it back in case of move rejection.
+        Restores the pre-move point, which also undoes any clamping.
+        """
+        self.pos[0] = self.oldx
+        self.pos[1] = self.oldy
 
     def get_probability(self):
         """ Return the (unnormalized) probability for this move. """
@@ -135,6 +141,7 @@ def test_integrated():
                                         ncycles=50,nstop=25)
 #    mcsled.random.random = random.random
     sim = mcsled.MCSim(sys,schedule)
+    sim.record_history = True
 
     # Run it.
     sim.anneal()
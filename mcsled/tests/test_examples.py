@@ -0,0 +1,102 @@
+"""
+Unit tests for the example systems in ../../examples.
+"""
+
+import os
+import sys
+import numpy as np
+import pytest
+import mcsled
+pytestmark = pytest.mark.unit
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "..","..","examples"))
+tspMC = pytest.importorskip("tspMC")
+MC1D = pytest.importorskip("MC1D")
+MCquadplus = pytest.importorskip("MCquadplus")
+
+
+def path_length(D,perm):
+    """ Tour length of perm from the distance matrix D, summed in float64. """
+    return sum(float(D[perm[k],perm[(k + 1) % len(perm)]])
+               for k in range(len(perm)))
+
+
+def test_tsp_dE():
+    print()
+    rng = np.random.default_rng(2024)
+    N = 12
+    coords = rng.random((N,2)) * 100.0
+    mysys = tspMC.System(N,coords,True)
+    D = mysys.energy.D
+    assert D.dtype == np.float32
+    perm = mysys.perm
+    for trial in range(500):
+        i,j = sorted(rng.choice(N,size=2,replace=False).tolist())
+        before = path_length(D,perm)
+        if i > 0:
+            dE = tspMC.twoopt_dE(D,perm,i,j)
+            perm[i:j + 1] = perm[i:j + 1][::-1]
+        else:
+            dE = tspMC.swap_dE(D,perm,i,j)
+            perm[i], perm[j] = perm[j], perm[i]
+        # dE is summed in float64, so it matches a float64 recompute
+        # from the same (float32) distances to rounding
+        assert dE == pytest.approx(path_length(D,perm) - before,abs=1.0e-9)
+    # and the distances themselves are good to float32 precision
+    assert path_length(D,perm) == pytest.approx(mysys.energy.E(perm),
+                                                rel=1.0e-6)
+
+
+def test_tsp_save_state():
+    print()
+    rng = np.random.default_rng(2024)
+    N = 12
+    mysys = tspMC.System(N,rng.random((N,2)) * 100.0,True)
+    mysys.perm[1:5] = mysys.perm[1:5][::-1]
+    mysys.commit(1.0)
+    # save_state resyncs the running total with the path length
+    mysys.save_state()
+    assert mysys.get_energy() == mysys.energy.E(mysys.perm)
+    assert (mysys.get_saved_state() == mysys.perm).all()
+
+
+def test_mc1d_incremental_move():
+    print()
+    mysys = MC1D.System(21,-3.5,3.5,ranseed=2024)
+    rng = np.random.default_rng(2024)
+    for trial in range(200):
+        move = mysys.moves[trial % 2]
+        assert isinstance(move,mcsled.IncrementalMove)
+        move.trial_move(*rng.random(2).tolist())
+        assert move.indices == (move.pidx,)
+        pos = mysys.pos.copy()
+        E = mysys.get_energy()
+        dE = mysys.get_energy_change(move)
+        move.make_move()
+        Enew = mysys.get_energy()
+        # a particle near a 1/d**6 wall makes E very large, so the
+        # difference of totals is only good relative to the larger one
+        tol = 1.0e-6 + 1.0e-12 * max(abs(E),abs(Enew))
+        assert Enew - E == pytest.approx(dE,abs=tol)
+        if trial % 3:
+            move.unmake_move()
+            assert (mysys.pos == pos).all()
+        assert (np.diff(mysys.pos) >= 0.0).all()
+
+
+def test_replica_moves():
+    print()
+    # the example moves take their uniforms from each MCSim, so copies of
+    # a system in ParallelTempering replicas make different proposals
+    mysys = MCquadplus.System(-5.0,5.0,-2.5,2.5,ranseed=1)
+    sched = mcsled.AnnealingSchedule(Ti=1.0,Tf=0.1,reduce=0.5)
+    pt = mcsled.ParallelTempering(mysys,sched,nreplicas=3,ranseed=7)
+    steps = []
+    for sim in pt.sims:
+        for move in sim.moves:
+            move.dx = None
+        sim.mc_step(1.0,sim.energy())
+        steps.extend((move.dx,move.dy) for move in sim.moves
+                     if move.dx is not None)
+    assert len(set(steps)) == 3
@@ -3,8 +3,12 @@ Unit tests for the mcsled package.
 """
 
 import importlib
+import os
 import sys
+import random
+import warnings
 import mcsled
+import numpy as np
 import pytest
 pytestmark = pytest.mark.unit
 
@@ -90,13 +94,23 @@ def myrandom():
         return nums[randcount]
 
 
+class Myrng:
+    """ Stands in for the numpy Generator of an MCSim. """
+
+    def random(self,size=None):
+        if size is None:
+            return myrandom()
+        nums = [myrandom() for i in range(np.prod(size))]
+        return np.array(nums).reshape(size)
+
+
 @pytest.fixture
 def get_test_obj():
     sled = mcsled
     sched = sled.AnnealingSchedule()
     mysys = Mysystem()
     obj = sled.MCSim(mysys,sched)
-    mcsled.random.random = myrandom
+    obj._rng = Myrng()
     return obj,mysys,sled
 
 
@@ -118,6 +132,17 @@ def test_decide(get_test_obj):
     assert decision is False  # e^-1 ~ 0.3678 < 0.4
 
 
+def test_metropolis_lut():
+    print()
+    T = 2.0
+    for dE in [0.01, 0.5, 1.0, 7.3, 40.0, 99.0]:
+        p = np.exp(-dE / T)
+        assert mcsled._metropolis_lut(dE,T,0.999 * p) is True
+        assert mcsled._metropolis_lut(dE,T,1.001 * p) is False
+        assert mcsled._metropolis(dE,T,0.999 * p) is True
+        assert mcsled._metropolis(dE,T,1.001 * p) is False
+
+
 def test_choose_move(get_test_obj):
     print()
     obj,junk,junk2 = get_test_obj
@@ -128,6 +153,132 @@ def test_choose_move(get_test_obj):
     assert imove == 1
 
 
+class Flipmove(mcsled.IncrementalMove):
+    """ Flips the sign of one spin of a chain. """
+
+    def __init__(self,spins):
+        super().__init__()
+        self.spins = spins
+        self.i = 0
+
+    def affected_indices(self):
+        self.i = (self.i + 1) % len(self.spins)
+        return (self.i,)
+
+    def make_move(self):
+        for i in self.indices:
+            self.spins[i] = -self.spins[i]
+
+
+class Chainsystem:
+    """ Ising-like chain, E = -sum s_i s_i+1, with an O(1) dE. """
+
+    def __init__(self,n):
+        self.use_dE = True
+        self.spins = [1] * n
+        self.moves = [Flipmove(self.spins)]
+
+    def get_moves(self):
+        return self.moves
+
+    def get_energy(self):
+        s = self.spins
+        return -sum(s[i] * s[i + 1] for i in range(len(s) - 1))
+
+    def get_energy_change(self,move):
+        s = self.spins
+        dE = 0
+        for i in move.indices:
+            for j in (i - 1,i + 1):
+                if 0 <= j < len(s):
+                    dE += 2 * s[i] * s[j]
+        return dE
+
+    def get_size(self):
+        return len(self.spins)
+
+
+def test_incremental_move():
+    print()
+    sched = mcsled.AnnealingSchedule()
+    chain = Chainsystem(40)
+    obj = mcsled.MCSim(chain,sched,ranseed=5)
+    E = chain.get_energy()
+    Enew = obj.mc_block(200,10.0,E)
+    assert Enew == chain.get_energy()
+
+
+FAST_SKIP = "the optional _fast extension is not built " \
+    "(cythonize -i mcsled/_fast.pyx)"
+
+
+def test_fast_steps():
+    print()
+    if mcsled._fast is None:
+        pytest.skip(FAST_SKIP)
+    sched = mcsled.AnnealingSchedule()
+    results = []
+    for use_fast in [False, True]:
+        chain = Chainsystem(40)
+        obj = mcsled.MCSim(chain,sched,ranseed=5)
+        obj.use_fast = use_fast
+        Enew = obj.mc_block(2000,2.0,chain.get_energy())
+        results.append((Enew,obj.lowE,obj.naccept,list(chain.spins)))
+    assert results[0] == results[1]
+
+
+def test_run_steps_fast():
+    print()
+    if mcsled._fast is None:
+        pytest.skip(FAST_SKIP)
+    sched = mcsled.AnnealingSchedule()
+    rands = np.random.default_rng(11).random((3000,4))
+    # one move type (search) and six (alias table)
+    for nmoves in [1, 6]:
+        results = []
+        for fast in [False, True]:
+            chain = Chainsystem(40)
+            chain.moves = [Flipmove(chain.spins) for i in range(nmoves)]
+            obj = mcsled.MCSim(chain,sched,ranseed=5)
+            E = chain.get_energy()
+            obj.lowE = E
+            if fast:
+                Enew = obj.run_steps_fast(rands,2.0,E)
+            else:
+                Enew = obj.run_steps(rands,2.0,E)
+            results.append((Enew,obj.lowE,obj.ntrial,obj.naccept,
+                            list(chain.spins)))
+        assert obj.use_alias == (nmoves > obj.max_search_moves)
+        assert results[0] == results[1]
+
+
+def test_performance_warning():
+    print()
+    sched = mcsled.AnnealingSchedule()
+    chain = Chainsystem(40)
+    chain.use_dE = False
+    with pytest.warns(mcsled.PerformanceWarning):
+        mcsled.MCSim(chain,sched)
+    chain.cheap_energy = True
+    with warnings.catch_warnings():
+        warnings.simplefilter("error",mcsled.PerformanceWarning)
+        mcsled.MCSim(chain,sched)
+
+
+def test_alias_table():
+    print()
+    probabilities = [0.05, 0.15, 0.3, 0.1, 0.4]
+    k = len(probabilities)
+    prob, alt = mcsled._alias_table(probabilities)
+    # each column c is picked with probability 1/k, and then gives
+    # c with probability prob[c] and alt[c] otherwise
+    recovered = [0.0] * k
+    for c in range(k):
+        recovered[c] += prob[c] / k
+        recovered[alt[c]] += (1.0 - prob[c]) / k
+    assert recovered == pytest.approx(probabilities)
+
+
 def decide_false(x,y):
     return False
 
@@ -173,6 +324,27 @@ def test_mc_step(get_test_obj):
     assert Enewnew == 2.0
 
 
+def test_commit(get_test_obj):
+    print()
+    obj,mysys,junk2 = get_test_obj
+    # Accepted moves are passed to the system's commit method
+    T = 1.0
+    mysys.use_dE = True
+    committed = []
+    obj.commit = committed.append
+
+    Enew = 1.0
+    mysys.dE = -0.5
+    obj.decide = decide_true
+    obj.energy_change = mysys.get_energy_change
+    obj.mc_step(T,Enew)
+    assert committed == [-0.5]
+
+    obj.decide = decide_false
+    obj.mc_step(T,Enew)
+    assert committed == [-0.5]
+
+
 def test_mc_block(get_test_obj):
     print()
     obj,mysys,junk2 = get_test_obj
@@ -209,25 +381,297 @@ def test_mc_block(get_test_obj):
     assert obj.lowE == -2.0
 
 
+def test_adapt_moves(get_test_obj):
+    print()
+    obj,mysys,junk2 = get_test_obj
+    mysys.use_dE = True
+    obj.energy_change = mysys.get_energy_change
+    obj.target_accept = 0.5
+    mysys.dE = 1.0
+    obj.moves[0].scale = 1.0
+    obj.decide = decide_false
+    obj.mc_block(10,1.0,0.0)
+    assert obj.ntrial == [10]
+    assert obj.naccept == [0]
+    assert obj.moves[0].scale == pytest.approx(np.exp(-0.1))
+    obj.decide = decide_true
+    obj.mc_block(10,1.0,0.0)
+    assert obj.naccept == [10]
+    assert obj.moves[0].scale == pytest.approx(1.0)
+
+
+class Arraysystem(Mysystem):
+    """ Mysystem with its state in a state_array. """
+
+    def __init__(self):
+        super().__init__()
+        self.state_array = np.zeros(3)
+        self.nsaves = 0
+
+    def save_state(self):
+        self.nsaves += 1
+        self.saved_state = self.state_array.copy()
+
+
+def test_fast_save():
+    print()
+    sched = mcsled.AnnealingSchedule()
+    mysys = Arraysystem()
+    obj = mcsled.MCSim(mysys,sched)
+    mysys.use_dE = True
+    obj.energy_change = mysys.get_energy_change
+    obj.decide = decide_true
+    obj.lowE = 1.0
+    mysys.dE = -1.0
+    # every step is a new low, but save_state is called once per block
+    Enewnew = obj.mc_block(5,1.0,1.0)
+    assert Enewnew == -4.0
+    assert obj.lowE == -4.0
+    assert mysys.nsaves == 1
+    mysys.dE = 1.0
+    obj.mc_block(5,1.0,Enewnew)
+    assert mysys.nsaves == 1
+
+
+@mcsled.njit
+def quad_trial_move(state,params,trial,rng):
+    trial[0] = state[0] + (2.0 * rng.random() - 1.0) * params[0]
+
+
+@mcsled.njit
+def quad_energy_change(state,trial):
+    return trial[0]**2 - state[0]**2
+
+
+@mcsled.njit
+def quad_make_move(state,trial):
+    state[0] = trial[0]
+
+
+class Quadmove:
+    def get_probability(self):
+        return 1
+
+    def get_params(self):
+        return [0.5]
+
+
+class Quadsystem:
+    """ x**2 on one coordinate, using the compiled use_numba path. """
+
+    def __init__(self,x):
+        self.use_dE = True
+        self.use_numba = True
+        self.state_array = np.array([x])
+        self.saved_state = None
+
+    def get_moves(self):
+        return [Quadmove()]
+
+    def get_energy(self):
+        return self.state_array[0]**2
+
+    def get_energy_change(self,move):
+        raise AssertionError("not used by the use_numba path")
+
+    def get_size(self):
+        return 1
+
+    def get_numba_kernels(self):
+        return quad_trial_move, quad_energy_change, quad_make_move
+
+    def save_state(self):
+        self.saved_state = self.state_array.copy()
+
+
+def test_mc_block_numba():
+    print()
+    sched = mcsled.AnnealingSchedule()
+    mysys = Quadsystem(3.0)
+    obj = mcsled.MCSim(mysys,sched,ranseed=1234)
+    Enew = mysys.get_energy()
+    obj.lowE = Enew
+    Enewnew = obj.mc_block(200,1.0e-8,Enew)
+    # only downhill moves are accepted at this temperature
+    assert Enewnew < Enew
+    assert Enewnew == pytest.approx(mysys.get_energy())
+    assert obj.lowE == Enewnew
+    assert mysys.saved_state[0] == mysys.state_array[0]
+    # commit gets the energy change of the whole block
+    mysys.commit = lambda dE: setattr(mysys,"E",mysys.E + dE)
+    mysys.E = Enewnew
+    obj = mcsled.MCSim(mysys,sched,ranseed=1234)
+    obj.lowE = Enewnew
+    Elast = obj.mc_block(200,1.0,Enewnew)
+    assert mysys.E == pytest.approx(Elast)
+    assert mysys.E == pytest.approx(mysys.get_energy())
+
+
+def test_parallel_tempering():
+    print()
+    sched = mcsled.AnnealingSchedule(Ti=1.0,Tf=0.01,reduce=0.5,ncycles=50)
+    mysys = Quadsystem(3.0)
+    pt = mcsled.ParallelTempering(mysys,sched,ranseed=4321)
+    assert pt.temperatures == [0.5**k for k in range(7)]
+    systems = pt.run(10)
+    assert len(systems) == 7
+    assert sorted(pt.order) == list(range(7))
+    assert sum(pt.nswaps) > 0
+    assert pt.lowE < 9.0
+    assert pt.lowE == pytest.approx(min(s.saved_state[0]**2
+                                       for s in systems),abs=1.0e-12)
+    # the input system is not changed
+    assert mysys.state_array[0] == 3.0
+    # replicas draw only from their own Generators: the global random
+    # state is untouched, and a seeded run is reproducible
+    random.seed(99)
+    before = random.getstate()
+    lowEs = []
+    for i in range(2):
+        pt = mcsled.ParallelTempering(mysys,sched,ranseed=4321)
+        pt.run(5)
+        lowEs.append([sim.lowE for sim in pt.sims])
+    assert random.getstate() == before
+    assert lowEs[0] == lowEs[1]
+
+
 def test_check_stop():
     print()
     sled = mcsled
     mysys = Mysystem()
     sched = sled.AnnealingSchedule(Ti=1.0,Tf=0.2,reduce=0.5,ncycles=3,nstop=5)
     obj = sled.MCSim(mysys,sched)
-    obj.Thistory = [1.0] * 12
-    obj.Eblockhistory = [1.0] * 12
 
     T = 1.0
     nstop = 5
     obj.lowE = 1.0
-    stopanneal = obj.check_early_stop(12,T,nstop)
+    for iblock in range(1,nstop + 1):
+        stopanneal = obj.check_early_stop(iblock,T,nstop)
+        assert stopanneal is False
+    stopanneal = obj.check_early_stop(nstop + 1,T,nstop)
     assert stopanneal is True
 
-    obj.lowE = 2.0
-    stopanneal = obj.check_early_stop(12,T,nstop)
+    obj.lowE = 0.5
+    stopanneal = obj.check_early_stop(nstop + 2,T,nstop)
     assert stopanneal is False
 
+    # changes within threshold of the start of the run do not reset it
+    for iblock in range(nstop + 3,2 * nstop + 2):
+        obj.lowE -= 0.1
+        stopanneal = obj.check_early_stop(iblock,T,nstop,threshold=0.45)
+    assert stopanneal is True
+    assert len(obj.Eblockhistory) == 0
+
+    obj.record_history = True
+    for iblock in range(20):
+        obj.check_early_stop(iblock,0.5 * iblock,nstop)
+    assert len(obj.Thistory) == 20
+    assert obj.Thistory[-1] == 9.5
+    assert obj.Eblockhistory[0] == obj.lowE
+
+
+def test_share_numpy():
+    print()
+    sched = mcsled.AnnealingSchedule()
+    mysys = Mysystem()
+    reps = mcsled.Replicates(mysys,sched,nproc=1)
+    table = np.arange(12.0).reshape(3,4)
+    shared = reps.share_numpy("table",table)
+    assert mysys.table is shared
+    assert np.array_equal(mysys.table,table)
+    assert "table" in mysys.shared_arrays
+    reps.release_shared()
+    assert np.array_equal(mysys.table,table)
+    assert mysys.shared_arrays == {}
+
+
+class Couplings:
+    """ Bond strengths of a Weightedchain, held apart from the system. """
+
+    def __init__(self,n):
+        self.J = np.linspace(0.5,1.5,n - 1)
+
+
+class Weightedchain(Chainsystem):
+    """ Chainsystem with E = -sum J_i s_i s_i+1, the J held by a nested
+    object, for share_numpy("couplings.J").
+    """
+
+    def __init__(self,n):
+        super().__init__(n)
+        self.couplings = Couplings(n)
+
+    def get_energy(self):
+        s = self.spins
+        J = self.couplings.J
+        return -sum(J[i] * s[i] * s[i + 1] for i in range(len(s) - 1))
+
+    def get_energy_change(self,move):
+        s = self.spins
+        J = self.couplings.J
+        dE = 0.0
+        for i in move.indices:
+            if i > 0:
+                dE += 2 * J[i - 1] * s[i - 1] * s[i]
+            if i < len(s) - 1:
+                dE += 2 * J[i] * s[i] * s[i + 1]
+        return dE
+
+
+@pytest.mark.parametrize("start_method",[None,"spawn"])
+def test_replicates_shared(start_method,monkeypatch):
+    print()
+    # Spawned workers import mcsled by name: make that the module the
+    # tests use, not the package directory of the same name.
+    monkeypatch.syspath_prepend(os.path.dirname(mcsled.__file__))
+    sched = mcsled.AnnealingSchedule(Ti=2.0,Tf=0.5,reduce=0.5,ncycles=5)
+    mysys = Weightedchain(20)
+    J = mysys.couplings.J.copy()
+    reps = mcsled.Replicates(mysys,sched,nproc=2,ranseed=99,
+                             start_method=start_method)
+    shared = reps.share_numpy("couplings.J",J)
+    assert mysys.couplings.J is shared
+    try:
+        output = reps.run()
+    finally:
+        reps.release_shared()
+    assert np.array_equal(mysys.couplings.J,J)
+    assert mysys.shared_arrays == {}
+    # each replicate matches a serial run from the same child seed
+    seeds = np.random.SeedSequence(99).spawn(2)
+    for outsys,seed in zip(output,seeds):
+        serial = Weightedchain(20)
+        mcsled.MCSim(serial,sched,ranseed=seed).anneal()
+        assert outsys.spins == serial.spins
+        assert np.array_equal(outsys.couplings.J,J)
+
+
+def test_ranseed():
+    print()
+    sched = mcsled.AnnealingSchedule()
+    draws = []
+    for seed in [1234, 1234, np.random.SeedSequence(1234)]:
+        obj = mcsled.MCSim(Mysystem(),sched,ranseed=seed)
+        draws.append([obj._rng.random() for i in range(3)])
+    assert draws[0] == draws[1] == draws[2]
+    obj = mcsled.MCSim(Mysystem(),sched,bitgen=np.random.PCG64(1234))
+    assert [obj._rng.random() for i in range(3)] == \
+        list(np.random.Generator(np.random.PCG64(1234)).random(3))
+    # without ranseed the seed comes from the random module
+    draws = []
+    for i in range(2):
+        random.seed(4321)
+        obj = mcsled.MCSim(Mysystem(),sched)
+        draws.append([obj._rng.random() for i in range(3)])
+    assert draws[0] == draws[1]
+    # and so do the child seeds of Replicates
+    entropy = []
+    for i in range(2):
+        random.seed(4321)
+        reps = mcsled.Replicates(Mysystem(),sched,nproc=2)
+        entropy.append(reps.seedseq.entropy)
+    assert entropy[0] == entropy[1]
+
 
 def test_anneal():
     print()
@@ -236,6 +680,7 @@ def test_anneal():
     sched = sled.AnnealingSchedule(Ti=1.0,Tf=0.2,reduce=0.5,ncycles=3,nstop=10)
     mysys = Mysystem()
     obj = sled.MCSim(mysys,sched)
+    obj.record_history = True
 
     mysys.use_dE = True
     mysys.E = 1.0